@@ -0,0 +1,187 @@
+"""
+Space Simulator CW2 - Event search
+Author:
+Lukas Kubinec
+Finds when two bodies line up with the Sun (conjunctions and oppositions) or come close to each other.
+Positions follow the same closed-form orbits as the simulation, so any time can be evaluated directly:
+a coarse vectorised sweep brackets every event and the brackets are then refined all at once.
+Long spans are split into chunks searched by a process pool. Runs headless, no window is needed.
+Usage:
+python analysis.py Earth Mars --years 1000
+python analysis.py Earth Mars --events close_approach --within 3 --years 5000 --json events.json
+"""
+
+# Import of necessary libraries
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scene import default_scene_path, load_scene, year_length
+from simulation import state_from_scene
+
+event_kinds = ("conjunction", "opposition", "close_approach")
+samples_per_period = 32         # Coarse samples over the shortest orbit involved, events closer than this merge
+time_tolerance = 1e-6           # Brackets are refined until they are this short (simulated time)
+golden_ratio = (np.sqrt(5) - 1) / 2
+
+# --- Methods ---
+# Orbit parameters of a body and all its parents, the only part of the state a worker process needs
+def orbit_chain(state, index):
+    chain = []
+    while index >= 0:
+        chain.append((float(state.distance[index]), float(state.orbit_speed[index]), float(state.phase[index])))
+        index = int(state.parent[index])
+    return tuple(chain)
+
+# Positions of a body at many times at once, (len(times), 2) - same formula as OrbitalState.evaluate
+def chain_positions(chain, times):
+    pos = np.zeros((len(times), 2))
+    for distance, orbit_speed, phase in chain:
+        angle = phase + np.radians(np.fmod(orbit_speed * times, 360.0))
+        pos[:, 0] += distance * np.cos(angle)
+        pos[:, 1] += distance * np.sin(angle)
+    return pos
+
+# Shortest orbit period among the bodies and their parents, sets the coarse sampling step
+def shortest_period(*chains):
+    speeds = [abs(orbit_speed) for chain in chains for _, orbit_speed, _ in chain if orbit_speed]
+    return 360.0 / max(speeds) if speeds else 360.0
+
+# Sine of the angle between the two bodies as seen from the Sun, and its cosine. The Sun sits at the origin, so a
+# conjunction here means the same direction from the Sun (for Earth and Mars that is Mars' opposition seen from Earth)
+def alignment(first, second, times):
+    a, b = chain_positions(first, times), chain_positions(second, times)
+    lengths = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    lengths[lengths == 0] = 1
+    cross = (a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]) / lengths
+    dot = np.einsum("ij,ij->i", a, b) / lengths
+    return cross, dot
+
+# Distance between the two bodies
+def separation(first, second, times):
+    return np.linalg.norm(chain_positions(first, times) - chain_positions(second, times), axis=1)
+
+# Roots of the alignment sine inside every bracket, refined together by bisection
+def refine_alignments(first, second, low, high, tolerance=time_tolerance):
+    low_sign = np.sign(alignment(first, second, low)[0])
+    iterations = int(np.ceil(np.log2(max(np.max(high - low, initial=0), tolerance) / tolerance)))
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        middle_sign = np.sign(alignment(first, second, middle)[0])
+        same = middle_sign == low_sign
+        low = np.where(same, middle, low)
+        high = np.where(same, high, middle)
+    return (low + high) / 2
+
+# Minima of the distance inside every bracket, refined together by golden-section search
+def refine_minima(first, second, low, high, tolerance=time_tolerance):
+    inner_low = high - golden_ratio * (high - low)
+    inner_high = low + golden_ratio * (high - low)
+    low_distance, high_distance = separation(first, second, inner_low), separation(first, second, inner_high)
+    iterations = int(np.ceil(np.log(max(np.max(high - low, initial=0), tolerance) / tolerance) / -np.log(golden_ratio)))
+    for _ in range(iterations):
+        # The kept inner point becomes one of the new inner points, so only one new distance is needed per step
+        lower = low_distance < high_distance
+        high = np.where(lower, inner_high, high)
+        low = np.where(lower, low, inner_low)
+        new_point = np.where(lower, high - golden_ratio * (high - low), low + golden_ratio * (high - low))
+        new_distance = separation(first, second, new_point)
+        inner_high, high_distance, inner_low, low_distance = (
+            np.where(lower, inner_low, new_point), np.where(lower, low_distance, new_distance),
+            np.where(lower, new_point, inner_high), np.where(lower, new_distance, high_distance))
+    return (low + high) / 2
+
+# Searches one chunk of the coarse time grid - samples first_sample to last_sample, plus one neighbour on each side
+def search_chunk(first, second, start, step, first_sample, last_sample, kinds, within):
+    times = start + step * np.arange(first_sample - 1, last_sample + 2)
+    events = []
+    if "conjunction" in kinds or "opposition" in kinds:
+        cross, _ = alignment(first, second, times)
+        # Sign changes between sample i and i + 1, counted by the chunk that owns sample i
+        brackets = np.flatnonzero(np.sign(cross[1:-1]) != np.sign(cross[2:])) + 1
+        roots = refine_alignments(first, second, times[brackets], times[brackets + 1])
+        _, dot = alignment(first, second, roots)
+        for time, cosine in zip(roots, dot):
+            kind = "conjunction" if cosine > 0 else "opposition"
+            if kind in kinds:
+                events.append({"kind": kind, "time": float(time)})
+    if "close_approach" in kinds:
+        distance = separation(first, second, times)
+        # Local minima of the sampled distance, rounding noise of a constant distance (a moon and its planet) is ignored
+        noise = 1e-9 * (1 + distance[1:-1])
+        candidates = np.flatnonzero((distance[1:-1] < distance[:-2] - noise) & (distance[1:-1] <= distance[2:] - noise)) + 1
+        minima = refine_minima(first, second, times[candidates - 1], times[candidates + 1])
+        for time, closest in zip(minima, separation(first, second, minima)):
+            if within is None or closest <= within:
+                events.append({"kind": "close_approach", "time": float(time), "distance": float(closest)})
+    return events
+
+def _search_chunk(arguments):
+    return search_chunk(*arguments)
+
+# Every event between two bodies from start to end, sorted by time
+def find_events(state, first_index, second_index, start, end, kinds=event_kinds, within=None, step=None, workers=None,
+                min_chunk_samples=50000):
+    kinds = tuple(kinds)
+    unknown = set(kinds) - set(event_kinds)
+    if unknown:
+        raise ValueError("Unknown event kinds: " + ", ".join(sorted(unknown)))
+    first, second = orbit_chain(state, first_index), orbit_chain(state, second_index)
+    step = step or shortest_period(first, second) / samples_per_period
+    sample_count = int(np.ceil((end - start) / step))
+    # One chunk per worker, but short spans are not worth starting processes for
+    workers = workers or os.cpu_count() or 1
+    chunk_samples = max(min_chunk_samples, -(-sample_count // workers))
+    chunks = [(first, second, start, step, chunk_start, min(chunk_start + chunk_samples, sample_count) - 1, kinds, within)
+              for chunk_start in range(0, sample_count, chunk_samples)]
+    if workers == 1 or len(chunks) == 1:
+        results = map(_search_chunk, chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_search_chunk, chunks))
+    # Refined times land within the tolerance of the true ones, so an event right at a limit may fall just outside it
+    events = [event for chunk_events in results for event in chunk_events
+              if start - time_tolerance <= event["time"] <= end + time_tolerance]
+    for event in events:
+        event["time"] = min(max(event["time"], start), end)
+    events.sort(key=lambda event: event["time"])
+    return events
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Finds conjunctions, oppositions and close approaches between two bodies")
+    parser.add_argument("bodies", nargs=2, help="Names of the two bodies, e.g. Earth Mars")
+    parser.add_argument("--scene", default=default_scene_path, help="Scene file with the celestial bodies")
+    parser.add_argument("--events", nargs="+", choices=event_kinds, default=list(event_kinds), help="Kinds of events to find")
+    parser.add_argument("--within", type=float, help="Close approaches only count below this distance")
+    parser.add_argument("--start", type=float, default=0.0, help="Start of the search in years")
+    parser.add_argument("--years", type=float, default=100.0, help="Length of the search in years")
+    parser.add_argument("--year-body", help="Body whose orbit defines a year, by default the scene's year body or Earth")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--json", help="Writes the events to this file")
+    args = parser.parse_args(argv)
+
+    scene = load_scene(args.scene)
+    state, names = state_from_scene(scene)
+    for name in args.bodies + ([args.year_body] if args.year_body else []):
+        if name not in names:
+            parser.error(f"No body named {name} in the scene, known bodies: {', '.join(names)}")
+    try:
+        year = year_length(scene, args.year_body)
+    except ValueError as error:
+        parser.error(str(error))
+    events = find_events(state, names.index(args.bodies[0]), names.index(args.bodies[1]), args.start * year,
+                         (args.start + args.years) * year, args.events, args.within, workers=args.workers)
+    for event in events:
+        event["year"] = event["time"] / year
+        distance = f" distance {event['distance']:.3f}" if "distance" in event else ""
+        print(f"{event['year']:12.4f} y  {event['kind']:<15}{distance}")
+    print(f"{len(events)} events in {args.years:g} years")
+    if args.json:
+        with open(args.json, "w") as events_file:
+            json.dump(events, events_file, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
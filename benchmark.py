@@ -0,0 +1,164 @@
+"""
+Space Simulator CW2 - Simulation benchmark
+Author:
+Lukas Kubinec
+Steps the headless simulation for N bodies over M steps and reports steps per second and memory use.
+No display or OpenGL context is needed, so it can run on CI machines without a GPU.
+Usage:
+python benchmark.py --bodies 10 1000 100000 --steps 1000
+python benchmark.py --bodies 10000 --steps 500 --json results.json --min-steps-per-second 200
+python benchmark.py --bodies 10 --particles 100000 --steps 200
+python benchmark.py --gravity --bodies 1000 10000 50000
+python benchmark.py --gravity --bodies 1000 10000 --max-relative-error 0.05 --max-energy-drift 1e-3
+"""
+
+# Import of necessary libraries
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+from nbody import GravitySimulation, barnes_hut_accelerations, direct_accelerations
+from particles import ParticleField
+from scene import default_scene_path, load_scene
+from simulation import Simulation, state_from_scene
+
+# --- Methods ---
+# Builds a simulation with the given number of bodies, every moon_every-th body orbits the body before it
+def build_simulation(body_count, moon_every=8, seed=0):
+    rng = np.random.default_rng(seed)
+    simulation = Simulation()
+    simulation.add_body(0, 0.0, 1) # Central star
+    for i in range(1, body_count):
+        if i % moon_every == 0:
+            simulation.add_body(rng.uniform(1.5, 3.0), rng.uniform(5.0, 15.0), 2, i - 1)
+        else:
+            simulation.add_body(rng.uniform(4.0, 35.0), rng.uniform(0.5, 5.0), 1)
+    return simulation
+
+# Total size of the arrays backing the orbital state
+def state_bytes(simulation):
+    return sum(value.nbytes for value in vars(simulation.state).values() if isinstance(value, np.ndarray))
+
+# Runs a single benchmark case and returns its measurements
+def run_case(body_count, steps, repeat=3, particle_count=0):
+    simulation = build_simulation(body_count)
+    if particle_count:
+        simulation.add_particle_field(ParticleField.belt(particle_count, 18.8, 20.2, 2.4077, 1.307))
+    simulation.step() # Warm up
+    best = float("inf")
+    tracemalloc.start()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(steps):
+            simulation.step()
+        best = min(best, time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "bodies": body_count,
+        "steps": steps,
+        "seconds": best,
+        "steps_per_second": steps / best,
+        "body_steps_per_second": steps * body_count / best,
+        "particles": particle_count,
+        "state_bytes": state_bytes(simulation) + sum(field.nbytes() for field in simulation.particle_fields),
+        "peak_step_bytes": peak,
+    }
+
+# Times Barnes-Hut force evaluation for a particle disc around a heavy centre, checked against direct summation
+def run_gravity_case(particle_count, direct_limit, seed=0):
+    rng = np.random.default_rng(seed)
+    radius = rng.uniform(4.0, 35.0, particle_count)
+    angle = rng.uniform(0, 2 * np.pi, particle_count)
+    pos = np.column_stack((radius * np.cos(angle), radius * np.sin(angle), rng.normal(0, 0.2, particle_count)))
+    mass = np.full(particle_count, 1e-6)
+    mass[0] = 4.2
+    pos[0] = 0
+    start = time.perf_counter()
+    acc = barnes_hut_accelerations(pos, mass)
+    result = {"bodies": particle_count, "barnes_hut_seconds": time.perf_counter() - start}
+    if particle_count <= direct_limit:
+        start = time.perf_counter()
+        reference = direct_accelerations(pos, mass)
+        result["direct_seconds"] = time.perf_counter() - start
+        error = np.linalg.norm(acc - reference, axis=1) / np.linalg.norm(reference, axis=1)
+        result["median_relative_error"] = float(np.median(error))
+        result["max_relative_error"] = float(error.max())
+    return result
+
+# Integrates the N-body mode seeded from a scene, the relative change of the total energy checks the integrator
+def run_energy_case(scene_path, steps, method, delta_time=Simulation().step_delta_time):
+    state, _ = state_from_scene(load_scene(scene_path))
+    gravity = GravitySimulation.from_orbital_state(state, method=method)
+    start_energy = gravity.energy()
+    for _ in range(steps):
+        gravity.step(delta_time)
+    return abs(gravity.energy() - start_energy) / abs(start_energy)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless simulation benchmark")
+    parser.add_argument("--bodies", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Body counts to benchmark")
+    parser.add_argument("--steps", type=int, default=1000, help="Steps per repetition")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions, the fastest one is reported")
+    parser.add_argument("--json", help="Writes the results to this file")
+    parser.add_argument("--min-steps-per-second", type=float, help="Fails when any case is slower than this")
+    parser.add_argument("--particles", type=int, default=0, help="Asteroid belt particles stepped along with the bodies")
+    parser.add_argument("--gravity", action="store_true", help="Benchmarks N-body force evaluation instead of orbit steps")
+    parser.add_argument("--direct-limit", type=int, default=20000, help="Largest body count also checked by direct summation")
+    parser.add_argument("--scene", default=default_scene_path, help="Scene integrated for the energy drift check")
+    parser.add_argument("--energy-steps", type=int, default=3000, help="Steps integrated for the energy drift check, 0 skips it")
+    parser.add_argument("--max-relative-error", type=float, help="Fails when the Barnes-Hut error against direct summation is larger")
+    parser.add_argument("--max-energy-drift", type=float, help="Fails when the relative energy drift is larger")
+    args = parser.parse_args(argv)
+
+    if args.gravity:
+        results = []
+        print(f"{'bodies':>10} {'barnes-hut s':>13} {'direct s':>10} {'median err':>11} {'max err':>9}")
+        for body_count in args.bodies:
+            result = run_gravity_case(body_count, args.direct_limit)
+            results.append(result)
+            print(f"{result['bodies']:>10} {result['barnes_hut_seconds']:>13.3f} {result.get('direct_seconds', float('nan')):>10.3f} "
+                  f"{result.get('median_relative_error', float('nan')):>11.2e} {result.get('max_relative_error', float('nan')):>9.2e}")
+        drift = {}
+        if args.energy_steps:
+            for method in ("barnes_hut", "direct"):
+                drift[method] = run_energy_case(args.scene, args.energy_steps, method)
+            print(f"Energy drift over {args.energy_steps} steps of the scene: barnes-hut {drift['barnes_hut']:.2e}, "
+                  f"direct {drift['direct']:.2e}")
+        if args.json:
+            with open(args.json, "w") as results_file:
+                json.dump({"forces": results, "energy_drift": drift}, results_file, indent=2)
+        failed = []
+        if args.max_relative_error is not None:
+            failed += [f"{result['bodies']} bodies error {result['max_relative_error']:.2e}" for result in results
+                       if result.get("max_relative_error", 0) > args.max_relative_error]
+        if args.max_energy_drift is not None:
+            failed += [f"{method} energy drift {value:.2e}" for method, value in drift.items() if value > args.max_energy_drift]
+        if failed:
+            print("Outside the accuracy limits: " + ", ".join(failed))
+            return 1
+        return 0
+
+    results = []
+    print(f"{'bodies':>10} {'steps':>8} {'steps/s':>12} {'body-steps/s':>14} {'state KiB':>10} {'peak KiB':>10}")
+    for body_count in args.bodies:
+        result = run_case(body_count, args.steps, args.repeat, args.particles)
+        results.append(result)
+        print(f"{result['bodies']:>10} {result['steps']:>8} {result['steps_per_second']:>12.1f} "
+              f"{result['body_steps_per_second']:>14.0f} {result['state_bytes'] / 1024:>10.1f} {result['peak_step_bytes'] / 1024:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.min_steps_per_second is not None:
+        slow = [result for result in results if result["steps_per_second"] < args.min_steps_per_second]
+        if slow:
+            print(f"Slower than {args.min_steps_per_second} steps/s: " + ", ".join(str(result["bodies"]) + " bodies" for result in slow))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Space Simulator CW2 - Camera helpers
+Author:
+Lukas Kubinec
+Screen-space measurements and view-frustum tests for the perspective camera set up by gluPerspective and gluLookAt in the main loop.
+"""
+
+# Import of necessary libraries
+import math
+import numpy as np
+
+# --- Methods ---
+# Radius in pixels of a sphere seen by a perspective camera
+def projected_radius(radius, centre, eye, fov, viewport_height):
+    distance_squared = sum((c - e) ** 2 for c, e in zip(centre, eye))
+    if distance_squared <= radius * radius:
+        return float("inf") # Camera is inside the sphere
+    # Tangent of the angle the sphere covers, against the tangent of half the vertical field of view
+    tangent = radius / math.sqrt(distance_squared - radius * radius)
+    return tangent / math.tan(math.radians(fov) / 2) * viewport_height / 2
+
+# Same matrix gluPerspective builds
+def perspective_matrix(fov, aspect, near, far):
+    f = 1.0 / math.tan(math.radians(fov) / 2)
+    return np.array([
+        [f / aspect, 0, 0, 0],
+        [0, f, 0, 0],
+        [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+        [0, 0, -1, 0],
+    ])
+
+# Same matrix gluLookAt builds
+def look_at_matrix(eye, centre, up):
+    eye = np.asarray(eye, dtype=float)
+    forward = np.asarray(centre, dtype=float) - eye
+    forward /= np.linalg.norm(forward)
+    side = np.cross(forward, up)
+    side /= np.linalg.norm(side)
+    true_up = np.cross(side, forward)
+    view = np.identity(4)
+    view[0, :3], view[1, :3], view[2, :3] = side, true_up, -forward
+    view[:3, 3] = -view[:3, :3] @ eye
+    return view
+
+# --- Classes ---
+# Six clipping planes of the camera, with counters of the bodies drawn and culled in the current frame
+class Frustum:
+    def __init__(self, clip_matrix):
+        # Planes (a, b, c, d) pointing inwards - left, right, bottom, top, near, far
+        rows = np.asarray(clip_matrix)
+        planes = np.array([rows[3] + rows[0], rows[3] - rows[0], rows[3] + rows[1],
+                           rows[3] - rows[1], rows[3] + rows[2], rows[3] - rows[2]])
+        self.planes = planes / np.linalg.norm(planes[:, :3], axis=1)[:, np.newaxis]
+        self.drawn = 0
+        self.culled = 0
+
+    @classmethod
+    def from_camera(cls, fov, aspect, near, far, eye, centre, up):
+        return cls(perspective_matrix(fov, aspect, near, far) @ look_at_matrix(eye, centre, up))
+
+    def sphere_visible(self, centre, radius):
+        # Bounding sphere test - hidden only when it lies fully behind one of the planes
+        x, y, z = centre
+        for a, b, c, d in self.planes:
+            if a * x + b * y + c * z + d < -radius:
+                return False
+        return True
+
+    def test_sphere(self, centre, radius):
+        # Visibility test that also updates the per-frame counters
+        visible = self.sphere_visible(centre, radius)
+        if visible:
+            self.drawn += 1
+        else:
+            self.culled += 1
+        return visible
+
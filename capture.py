@@ -0,0 +1,178 @@
+"""
+Space Simulator CW2 - Frame capture
+Author:
+Lukas Kubinec
+Renders frames into an offscreen framebuffer and reads them back through two pixel buffer objects,
+so the GPU copy of one frame overlaps the drawing of the next one.
+Pixel buffers are handed to background workers that write a PNG sequence or one raw RGBA stream,
+the drawing thread never waits on the disk or on compression.
+"""
+
+# Import of necessary libraries
+import ctypes
+import os
+import queue
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.error import GLError, NullFunctionError
+from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as read_pixels_into # Accepts an offset into the bound pack buffer
+
+png_signature = b"\x89PNG\r\n\x1a\n"
+
+# --- Methods ---
+# One PNG chunk - length, type, data and the CRC of type and data
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+
+# Encodes bottom-up RGBA rows as read back from OpenGL into an RGB PNG (the cleared background has zero alpha)
+def encode_png(pixels, compression_level=1):
+    height, width = pixels.shape[:2]
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8) # First byte of each row is the filter type, 0 = none
+    rows[:, 1:] = pixels[::-1, :, :3].reshape(height, width * 3)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0) # 8 bits per channel, RGB
+    return (png_signature + png_chunk(b"IHDR", header) +
+            png_chunk(b"IDAT", zlib.compress(rows.tobytes(), compression_level)) + png_chunk(b"IEND", b""))
+
+# --- Classes ---
+# Offscreen render target with asynchronous readback, frames are written by a pool of workers
+class FrameCapture:
+    def __init__(self, width, height, directory, image_format="png", workers=None, max_pending=8):
+        if image_format not in ("png", "raw"):
+            raise ValueError("Capture format has to be png or raw, not " + image_format)
+        self.width, self.height = width, height
+        self.directory = directory
+        self.image_format = image_format
+        self.frame_bytes = width * height * 4
+        self.frames_started = 0                 # Frames whose readback has been started
+        self.frames = 0                         # Frames submitted to the workers
+        self.written = 0                        # Frames already on disk
+        self.error = None                       # First error of a worker, raised by finish()
+        os.makedirs(directory, exist_ok=True)
+        # Raw frames go to a single stream in order, so only one worker writes them
+        if image_format == "raw":
+            workers = 1
+            self.stream = open(os.path.join(directory, f"frames_{width}x{height}_rgba.raw"), "wb")
+        else:
+            self.stream = None
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1), thread_name_prefix="capture")
+        # Pixel arrays travel to a worker and come back once written; at most max_pending frames are in flight
+        self.free_buffers = queue.Queue()
+        for _ in range(max_pending):
+            self.free_buffers.put(np.empty((height, width, 4), dtype=np.uint8))
+        self.lock = threading.Lock()
+        self._create_framebuffer()
+        self._create_pack_buffers()
+
+    def _create_framebuffer(self):
+        self.framebuffer = glGenFramebuffers(1)
+        self.colour_buffer, self.depth_buffer = glGenRenderbuffers(2)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.colour_buffer)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.colour_buffer)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth_buffer)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth_buffer)
+        complete = glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        if not complete:
+            raise RuntimeError("Offscreen framebuffer for the capture is not supported")
+
+    def _create_pack_buffers(self):
+        # Two pixel buffers - one receives the current frame while the previous one is read
+        self.pack_buffers = None
+        self.pending = [False, False]
+        try:
+            self.pack_buffers = list(glGenBuffers(2))
+            for pack_buffer in self.pack_buffers:
+                glBindBuffer(GL_PIXEL_PACK_BUFFER, pack_buffer)
+                glBufferData(GL_PIXEL_PACK_BUFFER, self.frame_bytes, None, GL_STREAM_READ)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        except (GLError, NullFunctionError):
+            self.pack_buffers = None # Frames are read back directly, which waits for the GPU
+
+    def begin_frame(self):
+        # Everything drawn until end_frame goes into the offscreen target
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glViewport(0, 0, self.width, self.height)
+
+    def end_frame(self, show=True):
+        # Starts the readback of this frame, hands the previous one to a worker and optionally shows the frame
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.framebuffer)
+        glReadBuffer(GL_COLOR_ATTACHMENT0)
+        if self.pack_buffers is None:
+            pixels = self.free_buffers.get()
+            glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+            self._submit(pixels)
+        else:
+            current = self.frames_started % 2
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pack_buffers[current])
+            read_pixels_into(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+            if self.pending[1 - current]:
+                self._collect(1 - current) # Finished while this frame was drawn
+            self.pending[current] = True
+        self.frames_started += 1
+        if show:
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+            glBlitFramebuffer(0, 0, self.width, self.height, 0, 0, self.width, self.height, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def _collect(self, index):
+        # Copies a finished readback into a pooled array, waits only when all arrays are still being written
+        pixels = self.free_buffers.get()
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pack_buffers[index])
+        address = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        if address:
+            ctypes.memmove(pixels.ctypes.data, address, self.frame_bytes)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.pending[index] = False
+        self._submit(pixels)
+
+    def _submit(self, pixels):
+        # The array itself goes to the worker, it returns to the pool once written
+        self.executor.submit(self._write, pixels, self.frames)
+        self.frames += 1
+
+    def _write(self, pixels, frame):
+        try:
+            if self.stream is None:
+                with open(os.path.join(self.directory, f"frame_{frame:06d}.png"), "wb") as image_file:
+                    image_file.write(encode_png(pixels))
+            else:
+                self.stream.write(np.ascontiguousarray(pixels[::-1]).data) # Top row first, like the PNG files
+        except Exception as error: # Raised again by finish(), the future itself is never read
+            self.error = self.error or error
+        finally:
+            self.free_buffers.put(pixels)
+            with self.lock:
+                self.written += 1
+
+    def finish(self):
+        # Collects the frames still on the GPU and waits for every worker, raises the first write error
+        if self.pack_buffers is not None:
+            for index in (self.frames_started % 2, (self.frames_started + 1) % 2):
+                if self.pending[index]:
+                    self._collect(index)
+        self.executor.shutdown(wait=True)
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.release()
+        if self.error is not None:
+            raise self.error
+
+    def release(self):
+        if self.pack_buffers is not None:
+            glDeleteBuffers(2, self.pack_buffers)
+            self.pack_buffers = None
+        if self.framebuffer is not None:
+            glDeleteRenderbuffers(2, [self.colour_buffer, self.depth_buffer])
+            glDeleteFramebuffers(1, [self.framebuffer])
+            self.framebuffer = None
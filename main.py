@@ -6,6 +6,14 @@ Controls:
 Arrow keys - Camera movement
 Mouse wheel - Zoom in-out
 Space - Pause / Resume
++ / - - Run the simulation faster / slower (time-lapse)
+O - Show / hide the orbits
+T - Show / hide the trails of recent positions
+F5 / F6 - Save / restore a snapshot of the simulation and the view
+R - Replay the keyframe log (when started with --record) / stop the replay
+Page Up / Page Down - Jump 100 years (orbits of the scene's year body, Earth by default) forward / back
+G - Switch between the orbits and gravitational N-body physics
+F9 - Save the frame profile as CSV and JSON (when started with --profile)
 """
 
 # Import of necessary libraries
@@ -13,7 +21,37 @@ import pygame
 from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
+import argparse
 import math
+import os
+import time
+import numpy as np
+import rendering
+from rendering import LineBatch, ParticleBatch, QuadBatch, RenderQueue, build_circle_arrays, clear_sphere_mesh_cache, get_sphere_mesh, nearest_lod_level, select_lod_level, sphere_lod_levels
+from camera import Frustum, projected_radius
+from simulation import Simulation, SimulationClock
+from particles import ParticleField
+from trails import TrailBuffer
+from snapshot import KeyframeLog, Replay, read_records, read_snapshot, write_snapshot
+from textures import TextureLoader, TextureResidency
+from scene import default_scene_path, find_body, load_scene, year_length
+from profiler import FrameProfiler
+from capture import FrameCapture
+
+# Command line options
+argument_parser = argparse.ArgumentParser(description="Solar system simulator")
+argument_parser.add_argument("--scene", default=default_scene_path, help="Scene file (JSON or TOML) with the celestial bodies")
+argument_parser.add_argument("--profile", action="store_true", help="Records per-frame timings, F9 saves them")
+argument_parser.add_argument("--sim-rate", type=float, default=60.0, help="Simulation steps per second, independent of the frame rate")
+argument_parser.add_argument("--sim-thread", action="store_true", help="Steps the simulation on its own thread")
+argument_parser.add_argument("--snapshot", default="solar_system.snapshot", help="Snapshot file used by F5 / F6 and --resume")
+argument_parser.add_argument("--resume", action="store_true", help="Starts from the snapshot and keeps saving it (kiosk mode)")
+argument_parser.add_argument("--record", help="Appends keyframes to this log, R replays it")
+argument_parser.add_argument("--capture", metavar="DIR", help="Renders offscreen and writes every frame to this directory")
+argument_parser.add_argument("--capture-format", choices=("png", "raw"), default="png", help="PNG sequence or one raw RGBA stream")
+argument_parser.add_argument("--capture-fps", type=float, default=60.0, help="Frame rate of the capture, every frame advances 1/FPS seconds")
+argument_parser.add_argument("--capture-frames", type=int, default=0, help="Quits after this many captured frames, 0 runs until quit")
+arguments = argument_parser.parse_args()
 
 # Initial game setup
 pygame.init()
@@ -28,8 +66,17 @@ glMatrixMode(GL_PROJECTION)
 glEnable(GL_DEPTH_TEST)
 glEnable(GL_CULL_FACE)
 glEnable(GL_ALPHA_TEST)
+glEnable(GL_NORMALIZE) # Keeps the normals of the scaled unit sphere at unit length
 glCullFace(GL_BACK)
 
+# Optional per-frame profiling of the main loop phases, enabled with --profile
+profiler = FrameProfiler(("events", "hover", "simulation", "camera", "ui", "trails", "draw_planet", "draw_moon",
+                          "render_queue", "particles", "capture", "flip"), enabled=arguments.profile)
+if profiler.enabled:
+    # Counts GL calls and state changes made here and in the shared rendering helpers
+    profiler.instrument_gl(globals())
+    profiler.instrument_gl(vars(rendering))
+
 # Gameplay variables
 active_object = 0                   # 0 = Sun / 1 = Mercury / 2 = Venus / etc.
 last_active_object = active_object  # Stores the last active button
@@ -37,14 +84,25 @@ all_planetary_objects = []          # Used as a storage for all UI elements
 all_button_objects = []             # Used as a storage for all 3D objects
 movement_speed_amount = 1.0         # Movement speed
 zoom_speed_amount = 1.0             # Zoom speed movement
-timePaused = False                  # Used for checking if the game is paused or not
 fps = 60.0                          # Frames per second (FPS)
 fov = 60.0                          # Camera Field of View (FOV)
-delta_time = 60.0 / 1000.0          # Converts milliseconds into seconds
+near_clip, far_clip = 0.01, 100.0   # Camera clipping distances
+simulated_time_per_second = 3.6    # Simulated time per real second at time scale 1 (60 milliseconds at 60 FPS before)
+simulation = Simulation(simulated_time_per_second / arguments.sim_rate) # Orbits of all celestial bodies
+time_scale_limits = (1 / 8, 256)    # Slowest and fastest time scale reachable with the + / - keys
+show_orbits, show_trails = True, True  # Toggled with the O and T keys
+trail_capacity = 512                # Samples kept per body
+trail_sample_interval = 0.5         # Simulated time between two trail samples
+trail_orbit_fraction = 0.5          # Longest trail as a fraction of the body's orbit
+autosave_interval = 30.0            # Real seconds between snapshots saved with --resume
+keyframe_interval = 600             # Simulation steps between keyframes written with --record
 
 # Variables for camera movement and Clamps for its maximum values
 camera_x, camera_y, camera_z = 0,0,0
 camera_x_max, camera_y_max, camera_z_min, camera_z_max = 5,5,-30,9
+camera_eye = (0, 0, 20) # Position of the camera, updated every frame
+view_frustum = Frustum.from_camera(fov, display[0] / display[1], near_clip, far_clip, camera_eye, (0, 0, 0), (0, 1, 0)) # Rebuilt every frame
+render_queue = RenderQueue() # Bodies of a frame, drawn sorted by state
 
 # Light settings
 glEnable(GL_LIGHTING)  # Enables lighting
@@ -55,17 +113,13 @@ glLightfv(GL_LIGHT0, GL_DIFFUSE, (0.8, 0.8, 0.8))  # Diffuse light
 glLightfv(GL_LIGHT0, GL_SPECULAR, (0.5,0.5,0.5)) # Specular light
 glShadeModel(GL_SMOOTH)  # Smooths out the polygons
 
-# Filepaths for Textures
-sun_texture = 'textures/2k_sun.jpg'
-mercury_texture = 'textures/2k_mercury.jpg'
-venus_texture = 'textures/2k_venus.jpg'
-earth_texture = 'textures/2k_earth.jpg'
-moon_texture = 'textures/2k_moon.jpg'
-mars_texture = 'textures/2k_mars.jpg'
-jupiter_texture = 'textures/2k_jupiter.jpg'
-saturn_texture = 'textures/2k_saturn.jpg'
-uranus_texture = 'textures/2k_uranus.jpg'
-neptune_texture = 'textures/2k_neptune.jpg'
+# Scene with all celestial bodies, textures are decoded on background threads once a body is first visible
+scene = load_scene(arguments.scene)
+texture_loader = TextureLoader()
+texture_residency = TextureResidency(texture_loader, lambda texture: apply_texture(texture, texture.data),
+                                     lambda texture_id: glDeleteTextures([texture_id]),
+                                     int(scene["texture_budget_mb"] * 1024 * 1024))
+seek_time_amount = 100 * year_length(scene) # Simulated time of 100 years, used when jumping through time
 
 # Definition of default colours
 gray_color = (0, 100, 100,255)
@@ -81,20 +135,54 @@ def quit_program():
     glDisable(GL_LIGHTING)
     glDisable(GL_TEXTURE_2D)
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)  # Clears the Colour and Depth buffers
-    pygame.quit()
+    simulation_clock.stop_thread()
+    if arguments.resume:
+        save_snapshot()
+    if simulation_clock.keyframe_log is not None:
+        simulation_clock.keyframe_log.close()
+    texture_residency.clear()
+    clear_sphere_mesh_cache() # Vertex buffers of the shared meshes
+    for _, belt_batch in all_particle_belts:
+        belt_batch.release()
+    trail_batch.release()
+    orbit_batch.release()
+    ui_panel.release() # Texture atlas of the button labels
+    texture_loader.shutdown()
+    try:
+        if frame_capture is not None:
+            frame_capture.finish() # Waits for the frames still being written, raises if one could not be written
+    finally:
+        pygame.quit()
     quit()
 
-# Calculation of X/Y coordinates when orbiting around a point
-def orbit_centre(xx, yy, centre_x, centre_y, orbit_speed):
-    angle = (orbit_speed / 2) * delta_time
-    _angle = math.radians(angle)
-    x_shift = ((xx-centre_x) * math.cos(_angle) - (yy-centre_y) * math.sin(_angle))
-    y_shift = ((xx-centre_x) * math.sin(_angle) + (yy-centre_y) * math.cos(_angle))
-    xx = (x_shift * math.cos(_angle) - y_shift * math.sin(_angle))
-    yy = (x_shift * math.sin(_angle) + y_shift * math.cos(_angle))
-    xx += centre_x
-    yy += centre_y
-    return angle, xx, yy
+# View stored with snapshots and keyframes
+def view_state():
+    return {"camera": (camera_x, camera_y, camera_z), "active_object": active_object, "time_scale": simulation_clock.time_scale}
+
+# Moves the camera to a stored view, with_timing also restores the time scale and pause
+def apply_view(view, with_timing=True):
+    global camera_x, camera_y, camera_z, active_object
+    camera_x, camera_y, camera_z = view["camera"]
+    if 0 <= view["active_object"] < len(all_planetary_objects):
+        active_object = view["active_object"]
+    if with_timing:
+        if view["time_scale"] > 0:
+            simulation_clock.set_time_scale(view["time_scale"])
+        if view["paused"] != simulation_clock.paused:
+            simulation_clock.toggle_pause()
+
+# Saves the simulation and the view in one write
+def save_snapshot():
+    write_snapshot(arguments.snapshot, simulation_clock.capture(view_state()))
+
+# Restores the snapshot file if there is one, a snapshot of a different scene is reported and ignored
+def load_snapshot():
+    if not os.path.exists(arguments.snapshot):
+        return
+    try:
+        apply_view(simulation_clock.restore(read_snapshot(arguments.snapshot)))
+    except ValueError as error:
+        print("Snapshot not restored:", error)
 
 # Generation of texture, returns id that is used to apply generated texture for each object individually
 def apply_texture(texture_image, texture_data):
@@ -126,110 +214,73 @@ def apply_two_d_texture(texture_image, texture_data):
 
 # --- Classes ---
 # Creation of celestial objects - Sun, Planets and Moons
+# Moons are solar objects with a parent, and can have satellites of their own
 class SolarObject:
-    def __init__(self, planet_texture, radius, slices, stacks, distance, orbit_speed, has_moon, _moon_texture):
-        # Textures
+    def __init__(self, planet_texture, radius, slices, stacks, distance, orbit_speed, name="", spin_speed=1, parent=None, phase=0.0):
+        self.name = name
+        # Textures - uploaded by the texture residency the first time the object is on screen
         self.texture_filename = planet_texture
-        self.texture_image = pygame.image.load(self.texture_filename)
-        self.texture_data = pygame.image.tobytes(self.texture_image, "RGBA", False)
-        self.planet_texture_id = apply_texture(self.texture_image, self.texture_data)  # Applies texture
-        # Physical attributes
-        self.pos_x, self.pos_y = distance,0 # Initial position
+        # Place in the body tree, positions of the whole tree are composed by the simulation once per step
+        self.parent = parent
+        self.children = []
+        parent_index = -1 if parent is None else parent.index
+        # Physical attributes - position, orbit and spin live in the shared orbital state
+        self.index = simulation.add_body(distance, orbit_speed, spin_speed, parent_index, phase)
         self.distance = distance
         self.radius = radius # Size of object
         self.slices, self.stacks = slices, stacks # Attributes of the sphere object
-        self.planet_orbit_angle = 0
-        self.planet_rotation_angle = 0
+        # Cached sphere meshes shared by all bodies, one per level of detail
+        self.meshes = [get_sphere_mesh(lod_slices, lod_stacks) for lod_slices, lod_stacks in sphere_lod_levels]
+        self.lod_level = nearest_lod_level(slices, stacks) # Starts at the requested tessellation
         self.orbit_speed = orbit_speed
-        # Moon attributes
-        self.has_moon = has_moon
-        if has_moon:
-            self.moon_texture = _moon_texture
-            self.moon_texture_image = pygame.image.load(self.moon_texture)
-            self.moon_texture_data = pygame.image.tobytes(self.moon_texture_image, "RGBA", False)
-            self.moon_radius = 0.7
-            self.moon_orbit_angle = 0
-            self.moon_rotation_angle = 0
-            self.moon_speed = 10
-            self.moon_distance = 2
-            # Initial position
-            self.moon_x = ((
-                    (self.moon_distance + self.pos_x) * math.cos(self.moon_orbit_angle) - self.pos_y * math.sin(self.moon_orbit_angle)))
-            self.moon_y = (
-                    (self.moon_distance + self.pos_x) * math.sin(self.moon_orbit_angle) + self.pos_y * math.cos(self.moon_orbit_angle))
-            #self.moon_x = ( + self.radius)
-            #self.moon_y = (self.pos_y + self.moon_distance + self.radius)
-            self.moon_texture_id = apply_texture(self.moon_texture_image, self.moon_texture_data)  # Applies moon texture
+        if parent is not None:
+            parent.children.append(self)
+
+    # Views onto the orbital state at the drawn time - positions are blended between the last two simulation steps,
+    # angles are evaluated at the blended time
+    @property
+    def pos_x(self):
+        return float(simulation_clock.render_pos[self.index, 0])
+
+    @property
+    def pos_y(self):
+        return float(simulation_clock.render_pos[self.index, 1])
+
+    @property
+    def planet_orbit_angle(self):
+        return float(simulation_clock.render_orbit_angle[self.index])
+
+    @property
+    def planet_rotation_angle(self):
+        return float(simulation_clock.render_spin_angle[self.index])
 
     def get_pos(self):
         return self.pos_x, self.pos_y
 
-    def draw_model(self, radius, angle, xx, yy, rotation_angle):
-        for i in range(self.stacks):
-            # Looping through latitude angles
-            lat0 = math.pi * (-0.5 + i / self.stacks)
-            lat1 = math.pi * (-0.5 + (i + 1) / self.stacks)
-            # Vertice positions
-            sin_lat0 = math.sin(lat0)
-            cos_lat0 = math.cos(lat0)
-            sin_lat1 = math.sin(lat1)
-            cos_lat1 = math.cos(lat1)
-            glBegin(GL_TRIANGLE_STRIP)
-            for j in range(self.slices + 1):
-                # Longitudes, with dynamic sphere rotation
-                lng = 2.0 * math.pi * j / self.slices + (angle + rotation_angle/5)
-                sin_lng = math.sin(lng)
-                cos_lng = math.cos(lng)
-                # Calculation of coordinates
-                x0 = xx + cos_lng * cos_lat0
-                y0 = yy +sin_lng * cos_lat0
-                z0 = sin_lat0
-                # Calculation of coordinates
-                x1 = xx +cos_lng * cos_lat1
-                y1 = yy +sin_lng * cos_lat1
-                z1 = sin_lat1
-                # Adjusting Normals used for light/shade characteristics
-                glNormal3f(x0, y0, z0)
-                glTexCoord2f(j / self.slices, i / self.stacks)
-                glVertex3f(radius * x0, radius * y0, radius * z0)
-                # Adjusting Normals used for light/shade characteristics
-                glNormal3f(x1, y1, z1)
-                glTexCoord2f(j / self.slices, (i + 1) / self.stacks)
-                glVertex3f(radius * x1, radius * y1, radius * z1)
-            glEnd()
-        glDisable(GL_TEXTURE_2D)
-
-    def draw_moon(self):
-        glEnable(GL_LIGHTING)
-        self.moon_orbit_angle, self.moon_x, self.moon_y = orbit_centre(self.moon_x, self.moon_y, (self.pos_x + self.radius / 2), (self.pos_y + self.radius / 2), self.moon_speed)
-        self.moon_rotation_angle += 2 * delta_time
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, self.moon_texture_id)
-        self.draw_model(self.moon_radius, self.moon_orbit_angle, self.moon_x, self.moon_y, self.moon_rotation_angle)
-
-    def draw_planet(self):
-        if self.pos_x == 0:
-            # Checks if the generated object is in the centre (SUN)
-            glDisable(GL_LIGHTING) # Disables lighting when drawing Sun
-        else:
-            # Enables lighting for objects other than Sun
-            glEnable(GL_LIGHTING)  # Enables lighting
-            self.planet_orbit_angle, self.pos_x, self.pos_y = orbit_centre(self.pos_x, self.pos_y, 0, 0, self.orbit_speed)
-        self.planet_rotation_angle += 1 * delta_time
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, self.planet_texture_id)
-        self.draw_model(self.radius, self.planet_orbit_angle, self.pos_x, self.pos_y, self.planet_rotation_angle)
-        if self.has_moon:
-            self.draw_moon()
+    def queue_model(self, radius, angle, xx, yy, rotation_angle, lod_level):
+        # Tessellation follows the size of the sphere on screen, returns the level used
+        lod_level = select_lod_level(lod_level, projected_radius(radius, (xx, yy, 0), camera_eye, fov, display[1]))
+        # Shared unit sphere placed by a model transform - position, spin around the pole and size
+        # The texture is None while it is still being decoded, the sphere is then drawn untextured
+        render_queue.submit(self.meshes[lod_level], texture_residency.acquire(self.texture_filename), self.distance != 0,
+                            (xx, yy, 0), math.degrees(angle + rotation_angle/5) % 360, radius)
+        return lod_level
+
+    def queue_planet(self):
+        # Satellites are queued first, each one culled on its own
+        if self.children:
+            with profiler.phase("draw_moon"):
+                for child in self.children:
+                    child.queue_planet()
+        if not view_frustum.test_sphere((self.pos_x, self.pos_y, 0), self.radius):
+            return # Planet is off-screen
+        # Lighting is off for the object in the centre (SUN), the render queue switches it once per group
+        self.lod_level = self.queue_model(self.radius, self.planet_orbit_angle, self.pos_x, self.pos_y, self.planet_rotation_angle, self.lod_level)
 
 # User Interface class
 class UIButton:
     def __init__(self,screen_x,screen_y,title, button_x, button_y, button_id):
-        # Set up of the coordinates
-        self.x = screen_x
-        self.y = screen_y
-        self.z = 0
-        # Values that only hold the offset
+        # Offset of the button from the camera, the UI panel places it every frame
         self._x = screen_x
         self._y = screen_y
         # Set up of Title
@@ -250,14 +301,9 @@ class UIButton:
             else:
                 self.idle_colour = dark_gray_color
             self.hover_colour = green_color
-        # Sets the draw color to normal state
-        self.draw_colour = self.idle_colour
         # Button ID
         self.button_id = button_id
-        self._texture_data = None
-        self.idle_texture = self.prepare_text_texture(self.idle_colour, self.title) # Prepares the Idle texture
-        self.hover_texture = self.prepare_text_texture(self.hover_colour, self.title)  # Prepares the Idle texture
-        self._texture_id = self.idle_texture
+        self.hovered = False # Shows the hover label, read by the UI panel
 
     def check_mouse_clicked_location(self, _active_object):
         # Checks if the mouse is located within the button position
@@ -268,184 +314,295 @@ class UIButton:
 
     def check_mouse_hover_location(self):
         # Checks if the mouse is located within the button position
-        if self.button_x < pygame.mouse.get_pos()[0] < self.button_x +70:
-            if self.button_y < pygame.mouse.get_pos()[1] < self.button_y +60:
-                # Displays hover texture
-                self._texture_id = self.hover_texture
-            else:
-                self._texture_id = self.idle_texture
-        else:
-            self._texture_id = self.idle_texture
+        mouse_x, mouse_y = pygame.mouse.get_pos()
+        self.hovered = self.button_x < mouse_x < self.button_x +70 and self.button_y < mouse_y < self.button_y +60
 
-    def prepare_text_texture(self, colour, text):
-        # Draws the pygame graphical elements onto a surface that then gets transformed into a texture
-        ui_button_text = text_font.render(text, True, (255, 255, 255,200))
+    def render_label(self, colour):
+        # Draws the pygame graphical elements onto a surface that becomes one tile of the UI atlas
+        ui_button_text = text_font.render(self.title, True, (255, 255, 255,200))
         ui_button_surface = pygame.Surface(self.ui_button_rect.size, pygame.SRCALPHA)
         ui_button_surface.fill(colour)
         ui_button_surface.blit(ui_button_text, self.ui_button_rect.midleft)
-        # Conversion of pygame draw into OpenGL texture
-        self._texture_data = pygame.image.tobytes(ui_button_surface, "RGBA", True)
-        _texture_id = apply_two_d_texture(self.ui_button_rect, self._texture_data)  # Converts image into usable texture data
-        return _texture_id
+        return ui_button_surface
+
+# Every UI button drawn in one batch - the idle and hover labels of all buttons are rendered once into a single
+# texture atlas, hovering a button only swaps the texture coordinates of its quad
+class UIPanel:
+    def __init__(self, buttons):
+        self.buttons = buttons
+        tile_width, tile_height = buttons[0].ui_button_rect.size
+        # Tiles on a square grid, idle label of button i at tile 2i and its hover label at 2i + 1
+        columns = math.ceil(math.sqrt(len(buttons) * 2))
+        rows = math.ceil(len(buttons) * 2 / columns)
+        atlas = pygame.Surface((columns * tile_width, rows * tile_height), pygame.SRCALPHA)
+        self.tiles = []
+        for tile, label in enumerate(label for button in buttons for label in (button.render_label(button.idle_colour),
+                                                                              button.render_label(button.hover_colour))):
+            column, row = tile % columns, tile // columns
+            atlas.blit(label, (column * tile_width, row * tile_height))
+            # Texture coordinates of the tile, the atlas is flipped so its top row ends up at v = 1
+            self.tiles.append((column / columns, 1 - (row + 1) / rows, (column + 1) / columns, 1 - row / rows))
+        self.texture_id = apply_two_d_texture(atlas.get_rect(), pygame.image.tobytes(atlas, "RGBA", True))
+        self.batch = QuadBatch(len(buttons))
+        for index, button in enumerate(buttons):
+            self.batch.set_quad(index, button._x, button._y, 1.0, 1.0)
+            self.batch.set_tex_coords(index, *self.tiles[index * 2])
+        self.shown_hover = [False] * len(buttons)
+
+    def update_hover(self):
+        # Only buttons whose hover state changed get new texture coordinates
+        for index, button in enumerate(self.buttons):
+            if button.hovered != self.shown_hover[index]:
+                self.shown_hover[index] = button.hovered
+                self.batch.set_tex_coords(index, *self.tiles[index * 2 + button.hovered])
 
     def draw(self, cam_x, cam_y, cam_z):
-        # Update the coordinates
-        self.x = cam_x + self._x
-        self.y = cam_y + self._y
-        self.z = -cam_z
-
-        glDisable(GL_LIGHTING)
-        glEnable(GL_TEXTURE_2D)
-        glBindTexture(GL_TEXTURE_2D, self._texture_id) # Applies texture to drawn object
-
-        # Begin draw
-        glBegin(GL_QUADS)
-        # Left Top
-        glTexCoord2f(0, 0)
-        glVertex3f(self.x, self.y,self.z+10)
-        # Right Top
-        glTexCoord2f(1, 0)
-        glVertex3f(self.x+1.0, self.y,self.z+10)
-        # Right Bottom
-        glTexCoord2f(1, 1)
-        glVertex3f(self.x+1.0, self.y+1.0,self.z+10)
-        # Left Bottom
-        glTexCoord2f(0, 1)
-        glVertex3f(self.x, self.y+1.0,self.z+10)
-
-        # End of draw method
-        glEnd()
-        glDisable(GL_TEXTURE_2D)
-        glEnable(GL_LIGHTING)
+        # The panel follows the camera, in front of everything else
+        self.batch.draw(self.texture_id, (cam_x, cam_y, 10 - cam_z))
+
+    def release(self):
+        if self.texture_id is not None:
+            glDeleteTextures([self.texture_id])
+            self.texture_id = None
 
 # Initialisation of objects
-# Planets (https://planetfacts.org/orbital-speed-of-planets-in-order/)
-model_slices, model_stacks = 24, 12
-Sun = SolarObject(sun_texture,          2.0, model_slices, model_stacks, 0, 0.0, False, None)
-all_planetary_objects.append(Sun)
-Mercury = SolarObject(mercury_texture,  0.9, model_slices, model_stacks, 4, 4.787, False, None)
-all_planetary_objects.append(Mercury)
-Venus = SolarObject(venus_texture,      1.0, model_slices, model_stacks, 7, 3.502, False, None)
-all_planetary_objects.append(Venus)
-Earth = SolarObject(earth_texture,      1.0, model_slices, model_stacks, 12, 2.978, True, moon_texture)
-all_planetary_objects.append(Earth)
-Mars = SolarObject(mars_texture,        0.95, model_slices, model_stacks, 18, 2.4077, False, None)
-all_planetary_objects.append(Mars)
-Jupiter = SolarObject(jupiter_texture,  1.15, model_slices, model_stacks, 21, 1.307, False, None)
-all_planetary_objects.append(Jupiter)
-Saturn = SolarObject(saturn_texture,    1.15, model_slices, model_stacks, 25, 0.969, False, None)
-all_planetary_objects.append(Saturn)
-Uranus = SolarObject(uranus_texture,    1.1, model_slices, model_stacks, 30, 0.681, False, None)
-all_planetary_objects.append(Uranus)
-Neptune = SolarObject(neptune_texture,  1.1, model_slices, model_stacks, 35, 0.543, False, None)
-all_planetary_objects.append(Neptune)
+# Creates the object of a scene body together with all of its satellites
+def create_solar_object(body, parent=None):
+    solar_object = SolarObject(body["texture"], body["radius"], model_slices, model_stacks, body["distance"], body["speed"],
+                               body["name"], body["spin"], parent, math.radians(body["phase"]))
+    for child in body["children"]:
+        create_solar_object(child, solar_object)
+    return solar_object
+
+model_slices, model_stacks = scene["slices"], scene["stacks"]
+for scene_body in scene["bodies"]:
+    all_planetary_objects.append(create_solar_object(scene_body))
+
+# Particle belts (e.g. asteroids between Mars and Jupiter), moved by the simulation and drawn as one batch of points each
+all_particle_belts = []
+for belt in scene["belts"]:
+    inner, outer = sorted((find_body(scene["bodies"], name) for name in belt["between"]), key=lambda body: body["distance"])
+    belt_field = simulation.add_particle_field(ParticleField.belt(belt["count"], inner["distance"] + belt["margin"],
+                                                                  outer["distance"] - belt["margin"], inner["speed"], outer["speed"]))
+    all_particle_belts.append((belt_field, ParticleBatch(belt["count"])))
+
+# Trails of every body, sampled by the simulation step, and the orbits around the Sun built once as a static batch
+trail_buffer = simulation.add_trail(TrailBuffer(simulation.state.count, trail_capacity, trail_sample_interval))
+for body_index, body_speed in enumerate(simulation.state.orbit_speed[:simulation.state.count]):
+    orbit_period = 360 / abs(body_speed) if body_speed else 0
+    trail_buffer.set_length(body_index, orbit_period * trail_orbit_fraction / trail_sample_interval)
+trail_batch = LineBatch(trail_buffer.vertices, (0.45, 0.6, 0.9), dynamic=True, version=trail_buffer.samples)
+orbit_distances = [planetary_object.distance for planetary_object in all_planetary_objects if planetary_object.distance > 0]
+orbit_segments = 128
+orbit_batch = LineBatch(build_circle_arrays(orbit_distances, orbit_segments))
+orbit_firsts = np.arange(len(orbit_distances), dtype=np.int32) * (orbit_segments + 1)
+orbit_counts = np.full(len(orbit_distances), orbit_segments + 1, dtype=np.int32)
+
+# Fixed-step clock that advances the simulation from real elapsed time, on its own thread when asked to
+simulation_clock = SimulationClock(simulation, arguments.sim_rate)
+if arguments.record:
+    simulation_clock.keyframe_log = KeyframeLog(arguments.record, keyframe_interval, view_state)
+    try:
+        simulation_clock.keyframe_log.open(simulation) # Continues the log of an earlier run
+    except ValueError as error:
+        argument_parser.error(f"--record: {error}")
+# Kiosk instances pick up where the last one stopped
+if arguments.resume:
+    load_snapshot()
+last_autosave = time.perf_counter()
+if arguments.sim_thread and not arguments.capture:
+    simulation_clock.start_thread() # A capture steps in the main loop, once per captured frame
+
+# Offscreen capture of every frame, written by background workers
+frame_capture = FrameCapture(display[0], display[1], arguments.capture, arguments.capture_format) if arguments.capture else None
 
 # UI buttons
-# Planetary objects buttons
-UI_button_sun = UIButton(+6, +4, "Sun", 910, 50,0)
-all_button_objects.append(UI_button_sun)
-UI_button_mercury = UIButton(+6, +3, "Mercury", 910, 124,1)
-all_button_objects.append(UI_button_mercury)
-UI_button_venus = UIButton(+6, +2, "Venus", 910, 196,2)
-all_button_objects.append(UI_button_venus)
-UI_button_earth = UIButton(+6, +1, "Earth", 910, 263,3)
-all_button_objects.append(UI_button_earth)
-UI_button_mars = UIButton(+6, +0, "Mars", 910, 327,4)
-all_button_objects.append(UI_button_mars)
-UI_button_jupiter = UIButton(+6, -1, "Jupiter", 910, 398,5)
-all_button_objects.append(UI_button_jupiter)
-UI_button_saturn = UIButton(+6, -2, "Saturn", 910, 465,6)
-all_button_objects.append(UI_button_saturn)
-UI_button_uranus = UIButton(+6, -3, "Uranus", 910, 527,7)
-all_button_objects.append(UI_button_uranus)
-UI_button_neptune = UIButton(+6, -4, "Neptune", 910, 600,8)
-all_button_objects.append(UI_button_neptune)
+# Planetary objects buttons, one per top level scene body (as many as fit the panel)
+button_rows = (50, 124, 196, 263, 327, 398, 465, 527, 600) # Screen Y of each button
+for button_index, planetary_object in enumerate(all_planetary_objects[:len(button_rows)]):
+    all_button_objects.append(UIButton(+6, 4 - button_index, planetary_object.name, 910, button_rows[button_index], button_index))
 # Other buttons
 UI_button_quit = UIButton(+6, -5, "Quit", 910, 660,-1)
 all_button_objects.append(UI_button_quit)
+ui_panel = UIPanel(all_button_objects) # All labels in one texture, drawn as one batch
 
 # Game loop
 isRunning = True
 while isRunning:
-    clock.tick(fps)  # Locks the framerate
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            quit_program()
-
-        if event.type == pygame.KEYDOWN:
-            # Camera movement
-            if event.key == pygame.K_LEFT and camera_x > -camera_x_max:
-                camera_x -= movement_speed_amount
-            if event.key == pygame.K_RIGHT and camera_x < camera_x_max:
-                camera_x += movement_speed_amount
-            if event.key == pygame.K_UP and camera_y < camera_y_max:
-                camera_y += movement_speed_amount
-            if event.key == pygame.K_DOWN and camera_y > -camera_y_max:
-                camera_y -= movement_speed_amount
-            if event.key == pygame.K_w:
-                camera_x = camera_x * math.cos(0.5) + camera_y * math.sin(0.5)
-                camera_y = camera_x * math.cos(0.5) - camera_y * math.sin(0.5)
-
-        if event.type == pygame.MOUSEWHEEL:
-            # Zoom in/out
-            if event.y == 1 and camera_z < camera_z_max:
-                camera_z += zoom_speed_amount # Zoom in
-            if event.y == -1 and camera_z > camera_z_min:
-                camera_z -= zoom_speed_amount # Zoom out
-
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            # Check for interactions with UI buttons
-            if event.button == 1:
-                for button in all_button_objects:
-                    last_active_object = active_object
-                    active_object = button.check_mouse_clicked_location(active_object)
-                    # Fail-safe if mouse is clicked outside of buttons
-                    if active_object is None:
-                        active_object = last_active_object # Defaults to the last active object
-                    # Check for Quit button
-                    if active_object == -1:
-                        quit_program() # Quits the program
-
-                    camera_x, camera_y = 0,0
-
-        if event.type == pygame.MOUSEMOTION:
-            # Check for mouse movements
-            for button in all_button_objects:
-                button.check_mouse_hover_location()
-
-        if event.type == pygame.KEYUP:
-            # Simulation pause/unpause
-            if event.key == pygame.K_SPACE:
-                if timePaused:
-                    delta_time = 60 / 1000.0 # Converts milliseconds into seconds
-                    timePaused = False
-                else:
-                    delta_time = 0
-                    timePaused = True
-
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT) # Clears the Colour and Depth buffers
-    glMatrixMode(GL_PROJECTION)
-    glLoadIdentity()
-    gluPerspective(fov, (display[0] / display[1]), 0.01,
-                   100.0)  # set up the projection, camera points and looks in the negative z axis direction
-    glMatrixMode(GL_MODELVIEW)
-    glLoadIdentity()
-
-    # Getting location of the active object
-    active_object_pos = all_planetary_objects[active_object].get_pos()
-    # Following active object
-    gluLookAt(camera_x+active_object_pos[0], camera_y+active_object_pos[1], 20 - camera_z, camera_x+active_object_pos[0], camera_y+active_object_pos[1], camera_z, 0, 1, 0)
+    if frame_capture is None:
+        frame_time = clock.tick(fps) / 1000.0 # Locks the framerate, real seconds since the last frame
+    else:
+        clock.tick() # Captures run as fast as they can render
+        frame_time = 1.0 / arguments.capture_fps # Fixed simulated step per frame, independent of the wall clock
+    profiler.begin_frame()
+    texture_residency.begin_frame()
+    with profiler.phase("events"):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                quit_program()
+
+            if event.type == pygame.KEYDOWN:
+                # Camera movement
+                if event.key == pygame.K_LEFT and camera_x > -camera_x_max:
+                    camera_x -= movement_speed_amount
+                if event.key == pygame.K_RIGHT and camera_x < camera_x_max:
+                    camera_x += movement_speed_amount
+                if event.key == pygame.K_UP and camera_y < camera_y_max:
+                    camera_y += movement_speed_amount
+                if event.key == pygame.K_DOWN and camera_y > -camera_y_max:
+                    camera_y -= movement_speed_amount
+                # Saving the frame profile
+                if event.key == pygame.K_F9 and profiler.enabled:
+                    profile_name = "profile_" + time.strftime("%Y%m%d-%H%M%S")
+                    profiler.export_csv(profile_name + ".csv")
+                    profiler.export_json(profile_name + ".json")
+                # Snapshots
+                if event.key == pygame.K_F5:
+                    save_snapshot()
+                if event.key == pygame.K_F6:
+                    load_snapshot()
+                # Jumping through time
+                if event.key == pygame.K_PAGEUP:
+                    simulation_clock.seek(simulation.time + seek_time_amount)
+                if event.key == pygame.K_PAGEDOWN:
+                    simulation_clock.seek(max(0.0, simulation.time - seek_time_amount))
+                if event.key == pygame.K_w:
+                    camera_x = camera_x * math.cos(0.5) + camera_y * math.sin(0.5)
+                    camera_y = camera_x * math.cos(0.5) - camera_y * math.sin(0.5)
+
+            if event.type == pygame.MOUSEWHEEL:
+                # Zoom in/out
+                if event.y == 1 and camera_z < camera_z_max:
+                    camera_z += zoom_speed_amount # Zoom in
+                if event.y == -1 and camera_z > camera_z_min:
+                    camera_z -= zoom_speed_amount # Zoom out
+
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                # Check for interactions with UI buttons
+                if event.button == 1:
+                    for button in all_button_objects:
+                        last_active_object = active_object
+                        active_object = button.check_mouse_clicked_location(active_object)
+                        # Fail-safe if mouse is clicked outside of buttons
+                        if active_object is None:
+                            active_object = last_active_object # Defaults to the last active object
+                        # Check for Quit button
+                        if active_object == -1:
+                            quit_program() # Quits the program
+
+                        camera_x, camera_y = 0,0
+
+            if event.type == pygame.MOUSEMOTION:
+                # Check for mouse movements
+                with profiler.phase("hover"):
+                    for button in all_button_objects:
+                        button.check_mouse_hover_location()
+                    ui_panel.update_hover()
+
+            if event.type == pygame.KEYUP:
+                # Simulation pause/unpause
+                if event.key == pygame.K_SPACE:
+                    simulation_clock.toggle_pause()
+                # Time-lapse speed
+                if event.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+                    simulation_clock.set_time_scale(min(simulation_clock.time_scale * 2, time_scale_limits[1]))
+                if event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    simulation_clock.set_time_scale(max(simulation_clock.time_scale / 2, time_scale_limits[0]))
+                # Orbits / gravity physics
+                if event.key == pygame.K_g:
+                    simulation_clock.toggle_gravity()
+                # Orbits and trails
+                if event.key == pygame.K_o:
+                    show_orbits = not show_orbits
+                if event.key == pygame.K_t:
+                    show_trails = not show_trails
+                # Replay of the keyframe log from its start
+                if event.key == pygame.K_r and arguments.record:
+                    if simulation_clock.replay is not None:
+                        simulation_clock.stop_replay()
+                    elif os.path.exists(arguments.record):
+                        simulation_clock.start_replay(Replay(read_records(arguments.record))) # Recording waits meanwhile
+
+    with profiler.phase("simulation"):
+        if simulation_clock.thread is None:
+            simulation_clock.advance(frame_time) # Fixed steps covering the real time of the last frame
+        simulation_clock.interpolate()
+        if simulation_clock.replay is not None:
+            # Camera follows the replayed keyframes, speed and pause stay with the viewer
+            with simulation_clock.lock:
+                replay_view, simulation_clock.replay.view = simulation_clock.replay.view, None
+            if replay_view is not None:
+                apply_view(replay_view, with_timing=False)
+            if simulation_clock.replay.finished:
+                simulation_clock.stop_replay()
+        if arguments.resume and time.perf_counter() - last_autosave > autosave_interval:
+            save_snapshot()
+            last_autosave = time.perf_counter()
+
+    with profiler.phase("camera"):
+        if frame_capture is not None:
+            frame_capture.begin_frame()
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT) # Clears the Colour and Depth buffers
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        gluPerspective(fov, (display[0] / display[1]), near_clip,
+                       far_clip)  # set up the projection, camera points and looks in the negative z axis direction
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+
+        # Getting location of the active object
+        active_object_pos = all_planetary_objects[active_object].get_pos()
+        # Following active object
+        camera_eye = (camera_x+active_object_pos[0], camera_y+active_object_pos[1], 20 - camera_z) # Also used for the level of detail
+        camera_centre = (camera_x+active_object_pos[0], camera_y+active_object_pos[1], camera_z)
+        gluLookAt(camera_eye[0], camera_eye[1], camera_eye[2], camera_centre[0], camera_centre[1], camera_centre[2], 0, 1, 0)
+        # Frustum from the same projection and camera, used to skip bodies that are off-screen
+        view_frustum = Frustum.from_camera(fov, display[0] / display[1], near_clip, far_clip, camera_eye, camera_centre, (0, 1, 0))
 
     glPushMatrix()  # The current OpenGL matrix is pushed down by one
 
     # Drawing UI
-    for button in all_button_objects:
-        button.draw(camera_x+active_object_pos[0],camera_y+active_object_pos[1], camera_z)
-
-    # Drawing planets
+    with profiler.phase("ui"):
+        ui_panel.draw(camera_x+active_object_pos[0],camera_y+active_object_pos[1], camera_z)
+
+    # Drawing the orbits and trails, each as one batch of line strips
+    with profiler.phase("trails"):
+        if show_trails:
+            with simulation_clock.lock:
+                # Only the slots of the samples taken since the last frame are uploaded
+                trail_batch.update_rows(trail_buffer.vertices, trail_buffer.written_runs(trail_batch.version), trail_buffer.samples)
+                trail_firsts, trail_counts = trail_buffer.ranges()
+            trail_batch.draw(trail_firsts, trail_counts)
+        if show_orbits and simulation.gravity is None:
+            orbit_batch.draw(orbit_firsts, orbit_counts) # After the trails so they stay on top, circles only match the orbits
+
+    # Drawing planets - queued first, then drawn sorted by lighting, texture and mesh
     for planetary_object in all_planetary_objects:
-        planetary_object.draw_planet()
+        with profiler.phase("draw_planet"):
+            planetary_object.queue_planet()
+    with profiler.phase("render_queue"):
+        render_queue.flush()
+
+    # Drawing the particle belts
+    with profiler.phase("particles"):
+        for belt_field, belt_batch in all_particle_belts:
+            belt_batch.draw(belt_field.positions)
 
     glPopMatrix()  # restore previous transformation
-    pygame.display.flip()
-    pygame.display.set_caption("CW2 - Solar system simulator | FPS:" + str(round(clock.get_fps())))
\ No newline at end of file
+    if frame_capture is not None:
+        with profiler.phase("capture"):
+            frame_capture.end_frame() # Also copies the frame to the window
+    with profiler.phase("flip"):
+        pygame.display.flip()
+    if frame_capture is not None and frame_capture.frames_started == arguments.capture_frames:
+        quit_program()
+    caption = ("CW2 - Solar system simulator | FPS:" + str(round(clock.get_fps())) +
+               (" | Paused" if simulation_clock.paused else " | Time x" + format(simulation_clock.time_scale, "g")) +
+               " | Drawn:" + str(view_frustum.drawn) + " Culled:" + str(view_frustum.culled))
+    if profiler.enabled:
+        caption += " | " + profiler.overlay_text() # Rolling frame time percentiles
+        caption += f" | Queue {render_queue.submitted} bodies {render_queue.state_changes} switches" # State sorting at work
+        caption += (f" | Textures {len(texture_residency.resident)} ({texture_residency.resident_bytes // (1024 * 1024)} MB)"
+                    f" uploads {texture_residency.uploads} evictions {texture_residency.evictions}") # Residency under the budget
+    pygame.display.set_caption(caption)
+    profiler.end_frame()
\ No newline at end of file
@@ -0,0 +1,179 @@
+"""
+Space Simulator CW2 - Gravitational N-body mode
+Author:
+Lukas Kubinec
+Optional physics mode: bodies attract each other and are moved by a leapfrog (kick-drift-kick) integrator.
+Forces come from a Barnes-Hut octree in O(n log n), or from direct O(n^2) summation as the accuracy reference.
+Only needs NumPy, so it runs headless like the rest of the simulation.
+"""
+
+# Import of necessary libraries
+import numpy as np
+
+gravitational_constant = 1.0            # Masses are given as G * M in simulation units
+tree_depth = 16                         # Octree levels below the root, 16 bits per axis fit a 48-bit Morton code
+default_theta = 0.5                     # Opening angle - cells smaller than theta * distance are treated as one mass
+default_softening = 1e-3                # Keeps close encounters finite
+
+# --- Methods ---
+# Spreads the lower 16 bits of every value so two zero bits separate each of them
+def spread_bits(values):
+    values = values.astype(np.uint64) & np.uint64(0xFFFF)
+    values = (values | (values << np.uint64(16))) & np.uint64(0x0000FF0000FF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00F00F00F00F)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0C30C30C30C3)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x249249249249)
+    return values
+
+# Morton (Z-order) code of every position inside the bounding cube
+def morton_codes(pos, origin, size):
+    cells = np.floor((pos - origin) / size * (1 << tree_depth)).astype(np.int64)
+    cells = np.clip(cells, 0, (1 << tree_depth) - 1)
+    return (spread_bits(cells[:, 0]) << np.uint64(2)) | (spread_bits(cells[:, 1]) << np.uint64(1)) | spread_bits(cells[:, 2])
+
+# Gravitational pull on a set of points from point masses, one pair per entry
+def pair_accelerations(delta, mass, softening):
+    distance_squared = np.einsum("ij,ij->i", delta, delta) + softening * softening
+    return delta * (gravitational_constant * mass / (distance_squared * np.sqrt(distance_squared)))[:, np.newaxis]
+
+# Reference O(n^2) accelerations, evaluated in blocks to bound memory
+def direct_accelerations(pos, mass, softening=default_softening, block_size=1024):
+    acc = np.zeros_like(pos)
+    for start in range(0, len(pos), block_size):
+        delta = pos[np.newaxis, :, :] - pos[start:start + block_size, np.newaxis, :]
+        distance_squared = np.einsum("ijk,ijk->ij", delta, delta) + softening * softening
+        weights = gravitational_constant * mass[np.newaxis, :] / (distance_squared * np.sqrt(distance_squared))
+        acc[start:start + block_size] = np.einsum("ij,ijk->ik", weights, delta) # Self terms have delta 0
+    return acc
+
+# Accelerations from a freshly built Barnes-Hut tree
+def barnes_hut_accelerations(pos, mass, theta=default_theta, softening=default_softening):
+    return BarnesHutTree(pos, mass).accelerations(pos, theta, softening)
+
+# --- Classes ---
+# Octree stored level by level - every level holds its cells sorted by Morton code
+class BarnesHutTree:
+    def __init__(self, pos, mass):
+        lower, upper = pos.min(axis=0), pos.max(axis=0)
+        self.size = float(max((upper - lower).max(), 1e-12)) * (1 + 1e-9) # Edge of the root cube
+        self.origin = lower
+        codes = morton_codes(pos, self.origin, self.size)
+        order = np.argsort(codes, kind="stable")
+        codes, sorted_mass, sorted_pos = codes[order], mass[order], pos[order]
+        weighted_pos = sorted_pos * sorted_mass[:, np.newaxis]
+        self.levels = []
+        for level in range(tree_depth + 1):
+            level_codes = codes >> np.uint64(3 * (tree_depth - level))
+            # Particles of one cell are next to each other, so each cell is a run of equal codes
+            starts = np.flatnonzero(np.r_[True, level_codes[1:] != level_codes[:-1]])
+            cell_mass = np.add.reduceat(sorted_mass, starts)
+            centre = np.add.reduceat(weighted_pos, starts) / np.where(cell_mass > 0, cell_mass, 1)[:, np.newaxis]
+            self.levels.append({
+                "codes": level_codes[starts],
+                "mass": cell_mass,
+                "centre": centre,
+                "count": np.diff(np.r_[starts, len(codes)]),
+            })
+        # Children of a cell are the run of cells on the next level whose parent code matches
+        for level, next_level in zip(self.levels, self.levels[1:]):
+            parent_codes = next_level["codes"] >> np.uint64(3)
+            level["child_start"] = np.searchsorted(parent_codes, level["codes"], side="left")
+            level["child_end"] = np.searchsorted(parent_codes, level["codes"], side="right")
+
+    def accelerations(self, points, theta=default_theta, softening=default_softening):
+        acc = np.zeros_like(points)
+        # Pairs of (point, cell) still to be resolved, everything starts at the root
+        point_index = np.arange(len(points))
+        cell_index = np.zeros(len(points), dtype=np.intp)
+        for depth, level in enumerate(self.levels):
+            if not len(point_index):
+                break
+            delta = level["centre"][cell_index] - points[point_index]
+            distance_squared = np.einsum("ij,ij->i", delta, delta)
+            cell_size = self.size / (1 << depth)
+            accepted = (cell_size * cell_size < theta * theta * distance_squared) | (level["count"][cell_index] == 1)
+            if depth == tree_depth:
+                accepted[:] = True # Deepest cells are only split further by identical positions
+            pull = pair_accelerations(delta[accepted], level["mass"][cell_index[accepted]], softening)
+            for axis in range(3):
+                acc[:, axis] += np.bincount(point_index[accepted], pull[:, axis], minlength=len(points))
+            # Opened cells are replaced by their children on the next level
+            point_index, cell_index = point_index[~accepted], cell_index[~accepted]
+            if depth < tree_depth and len(point_index):
+                first = level["child_start"][cell_index]
+                children = level["child_end"][cell_index] - first
+                point_index = np.repeat(point_index, children)
+                run_start = np.repeat(np.cumsum(children) - children, children)
+                cell_index = np.repeat(first, children) + np.arange(len(point_index)) - run_start
+        return acc
+
+# Bodies moved by their mutual gravity, positions and velocities are (n, 3) arrays
+class GravitySimulation:
+    def __init__(self, pos, vel, mass, method="barnes_hut", theta=default_theta, softening=default_softening):
+        self.pos = np.array(pos, dtype=float)
+        self.vel = np.array(vel, dtype=float)
+        self.mass = np.array(mass, dtype=float)
+        self.method = method            # "barnes_hut" or "direct"
+        self.theta = theta
+        self.softening = softening
+        self.acc = self.accelerations()
+
+    @classmethod
+    def from_orbital_state(cls, state, planet_mass_ratio=1e-5, host_mass_ratio=1e-3, **kwargs):
+        # Seeds positions and masses from the kinematic orbits (distance and orbit speed of every body)
+        n = state.count
+        parent = state.parent[:n]
+        distance = state.distance[:n]
+        at_origin = distance == 0
+        # Bodies orbiting the origin circle the first body sitting there (the Sun)
+        star = int(np.argmax(at_origin)) if at_origin.any() else -1
+        centre = np.where(parent >= 0, parent, star)
+        orbiting = ~at_origin & (centre >= 0)
+        # Kepler's third law gives the mass that holds each orbit: G * M = omega^2 * distance^3, averaged per centre
+        kepler_mass = np.radians(state.orbit_speed[:n]) ** 2 * distance ** 3
+        totals = np.bincount(centre[orbiting], kepler_mass[orbiting], minlength=n)
+        counts = np.bincount(centre[orbiting], minlength=n)
+        mass = np.where(counts > 0, totals / np.maximum(counts, 1), 0) / gravitational_constant
+        # Moons of the scenes orbit far faster than their planet's share of the star allows, so the masses of hosts
+        # are capped (about Jupiter against the Sun) - uncapped, they pull the other planets off their orbits
+        star_mass = mass[star] if star >= 0 else mass.max(initial=0)
+        hosts = np.arange(n) != star
+        mass[hosts] = np.minimum(mass[hosts], star_mass * host_mass_ratio)
+        mass[mass == 0] = (star_mass or 1.0) * planet_mass_ratio
+        # Circular velocity around each centre, parents are resolved before their children
+        pos = np.zeros((n, 3))
+        pos[:, :2] = state.pos[:n]
+        vel = np.zeros((n, 3))
+        for indices in state.levels():
+            indices = indices[orbiting[indices]]
+            centres = centre[indices]
+            offset = pos[indices, :2] - pos[centres, :2]
+            speed = np.sqrt(gravitational_constant * mass[centres] / distance[indices])
+            direction = np.where(state.orbit_speed[indices] < 0, -1.0, 1.0)
+            vel[indices, 0] = vel[centres, 0] - direction * speed * offset[:, 1] / distance[indices]
+            vel[indices, 1] = vel[centres, 1] + direction * speed * offset[:, 0] / distance[indices]
+        # Zero total momentum, so the system as a whole does not drift away from the origin
+        vel -= np.sum(vel * mass[:, np.newaxis], axis=0) / mass.sum()
+        return cls(pos, vel, mass, **kwargs)
+
+    def accelerations(self):
+        if self.method == "direct":
+            return direct_accelerations(self.pos, self.mass, self.softening)
+        return barnes_hut_accelerations(self.pos, self.mass, self.theta, self.softening)
+
+    def step(self, delta_time):
+        # Kick-drift-kick leapfrog, symplectic so energy errors stay bounded over long runs
+        self.vel += self.acc * (delta_time / 2)
+        self.pos += self.vel * delta_time
+        self.acc = self.accelerations()
+        self.vel += self.acc * (delta_time / 2)
+
+    def energy(self):
+        # Total energy from the direct sum, used to check the integration
+        kinetic = 0.5 * np.sum(self.mass * np.einsum("ij,ij->i", self.vel, self.vel))
+        potential = 0.0
+        for index in range(len(self.pos) - 1):
+            delta = self.pos[index + 1:] - self.pos[index]
+            distance = np.sqrt(np.einsum("ij,ij->i", delta, delta) + self.softening * self.softening)
+            potential -= np.sum(self.mass[index] * self.mass[index + 1:] / distance)
+        return kinetic + gravitational_constant * potential
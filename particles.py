@@ -0,0 +1,47 @@
+"""
+Space Simulator CW2 - Particle fields
+Author:
+Lukas Kubinec
+Large numbers of small bodies (asteroid belts) kept in contiguous arrays and moved in one vectorised update.
+Orbits use the same closed form as the planets: angle = phase + speed * time.
+"""
+
+# Import of necessary libraries
+import numpy as np
+
+# --- Classes ---
+# Small bodies on circular orbits around the origin, positions are a float32 (n, 3) array ready for drawing
+class ParticleField:
+    def __init__(self, distance, phase, orbit_speed, height):
+        self.count = len(distance)
+        self.distance = np.asarray(distance, dtype=np.float32)          # Orbit radius
+        self.phase = np.asarray(phase, dtype=np.float64)                # Orbit angle at time 0 in radians
+        self.orbit_speed = np.asarray(orbit_speed, dtype=np.float64)    # Degrees per unit of simulated time
+        self.positions = np.zeros((self.count, 3), dtype=np.float32)
+        self.positions[:, 2] = height                                   # Height above the orbital plane stays fixed
+        self._angle = np.empty(self.count)                              # Scratch space reused by every update
+        self._trig = np.empty(self.count, dtype=np.float32)
+        self.update(0.0)
+
+    @classmethod
+    def belt(cls, count, inner_distance, outer_distance, inner_speed, outer_speed, thickness=0.3, seed=0):
+        # Belt between two orbits, speeds blend from the inner to the outer orbit
+        rng = np.random.default_rng(seed)
+        distance = rng.uniform(inner_distance, outer_distance, count)
+        blend = (distance - inner_distance) / (outer_distance - inner_distance)
+        orbit_speed = inner_speed + (outer_speed - inner_speed) * blend
+        return cls(distance, rng.uniform(0, 2 * np.pi, count), orbit_speed, rng.normal(0, thickness, count))
+
+    def update(self, time):
+        # Same precision trick as the planets - degrees are reduced before they are turned into radians
+        np.multiply(self.orbit_speed, time, out=self._angle)
+        np.fmod(self._angle, 360.0, out=self._angle)
+        np.radians(self._angle, out=self._angle)
+        self._angle += self.phase
+        np.cos(self._angle, out=self._trig, casting="same_kind")
+        np.multiply(self._trig, self.distance, out=self.positions[:, 0])
+        np.sin(self._angle, out=self._trig, casting="same_kind")
+        np.multiply(self._trig, self.distance, out=self.positions[:, 1])
+
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.distance, self.phase, self.orbit_speed, self.positions, self._angle, self._trig))
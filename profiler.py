@@ -0,0 +1,139 @@
+"""
+Space Simulator CW2 - Frame profiler
+Author:
+Lukas Kubinec
+Optional instrumentation of the main loop - time spent in each phase of a frame, GL calls and GL state changes.
+Samples are kept in a fixed-size ring buffer and can be written out as CSV or JSON at any time.
+"""
+
+# Import of necessary libraries
+import contextlib
+import csv
+import json
+import time
+import numpy as np
+
+# GL functions that change the pipeline state, counted on top of the plain call count
+gl_state_functions = ("glEnable", "glDisable", "glBindTexture", "glBindBuffer", "glEnableClientState",
+                      "glDisableClientState", "glActiveTexture", "glMatrixMode", "glShadeModel")
+gl_draw_functions = ("glBegin", "glDrawArrays", "glDrawElements", "glMultiDrawArrays")
+counter_names = ("gl_calls", "state_changes", "texture_binds", "draw_calls")
+
+# --- Classes ---
+# Collects per-frame timings; every method is a no-op while the profiler is disabled
+class FrameProfiler:
+    def __init__(self, phases, capacity=1024, enabled=True):
+        self.enabled = enabled
+        self.phases = tuple(phases)
+        self.phase_index = {name: index for index, name in enumerate(self.phases)}
+        self.capacity = capacity
+        # Ring buffer - one row per frame, phase times in seconds followed by the whole frame time
+        self.times = np.zeros((capacity, len(self.phases) + 1))
+        self.counters = np.zeros((capacity, len(counter_names)), dtype=np.int64)
+        self.frames = 0                                 # Frames recorded since start, the newest row is frames - 1
+        self._row_times = np.zeros(len(self.phases))
+        self._row_counters = np.zeros(len(counter_names), dtype=np.int64)
+        self._stack = []                                # Started phases [index, start, time spent in nested phases]
+        self._frame_start = None
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self._row_times[:] = 0
+        self._row_counters[:] = 0
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if not self.enabled or self._frame_start is None:
+            return
+        row = self.frames % self.capacity
+        self.times[row, :-1] = self._row_times
+        self.times[row, -1] = time.perf_counter() - self._frame_start
+        self.counters[row] = self._row_counters
+        self.frames += 1
+        self._frame_start = None
+
+    @contextlib.contextmanager
+    def _timed_phase(self, name):
+        # Time of nested phases is not counted twice - each phase keeps only its own time
+        entry = [self.phase_index[name], time.perf_counter(), 0.0]
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - entry[1]
+            self._row_times[entry[0]] += elapsed - entry[2]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed_phase(name)
+
+    def instrument_gl(self, namespace):
+        # Wraps every gl*/glu* function in a module namespace (e.g. globals()) so calls to it are counted
+        for name, function in list(namespace.items()):
+            if name.startswith("gl") and callable(function) and not isinstance(function, type):
+                counters = [0]
+                if name in gl_state_functions:
+                    counters.append(1)
+                if name == "glBindTexture":
+                    counters.append(2)
+                if name in gl_draw_functions:
+                    counters.append(3)
+                namespace[name] = self._counted(function, counters)
+
+    def _counted(self, function, counters):
+        def counted_call(*args, **kwargs):
+            if self.enabled:
+                self._row_counters[counters] += 1
+            return function(*args, **kwargs)
+        counted_call.__name__ = getattr(function, "__name__", "gl_call")
+        return counted_call
+
+    def recorded(self):
+        # Rows in the ring buffer from the oldest to the newest frame
+        count = min(self.frames, self.capacity)
+        order = (np.arange(count) + self.frames - count) % self.capacity
+        return self.times[order], self.counters[order]
+
+    def frame_percentiles(self, percentiles=(50, 95, 99)):
+        # Frame time percentiles in milliseconds over the buffered frames
+        times, _ = self.recorded()
+        if not len(times):
+            return tuple(0.0 for _ in percentiles)
+        return tuple(np.percentile(times[:, -1], percentiles) * 1000)
+
+    def overlay_text(self):
+        p50, p95, p99 = self.frame_percentiles()
+        _, counters = self.recorded()
+        text = f"p50 {p50:.1f}ms p95 {p95:.1f}ms p99 {p99:.1f}ms"
+        if len(counters):
+            # GL work of the last recorded frame
+            text += " | GL calls {} states {} binds {} draws {}".format(*counters[-1])
+        return text
+
+    def export_csv(self, path):
+        times, counters = self.recorded()
+        first_frame = self.frames - len(times)
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(("frame",) + tuple(name + "_ms" for name in self.phases) + ("frame_ms",) + counter_names)
+            for offset, (time_row, counter_row) in enumerate(zip(times, counters)):
+                writer.writerow([first_frame + offset] + [round(value * 1000, 4) for value in time_row] + counter_row.tolist())
+
+    def export_json(self, path):
+        times, counters = self.recorded()
+        p50, p95, p99 = self.frame_percentiles()
+        trace = {
+            "first_frame": self.frames - len(times),
+            "phases": list(self.phases),
+            "frame_ms_percentiles": {"p50": p50, "p95": p95, "p99": p99},
+            "phase_ms": {name: (times[:, index] * 1000).tolist() for index, name in enumerate(self.phases)},
+            "frame_ms": (times[:, -1] * 1000).tolist(),
+            "counters": {name: counters[:, index].tolist() for index, name in enumerate(counter_names)},
+        }
+        with open(path, "w") as json_file:
+            json.dump(trace, json_file)
@@ -0,0 +1,330 @@
+"""
+Space Simulator CW2 - Rendering helpers
+Author:
+Lukas Kubinec
+Shared GPU resources used by the main loop:
+Sphere meshes - built once per (slices, stacks) and drawn through a model transform
+Level of detail - tessellation picked from the projected size of a body on screen
+Particle batches - thousands of points streamed into one buffer and drawn with a single call
+Line batches - orbit circles and trails, many line strips drawn with a single call
+Render queue - the bodies of a frame sorted by lighting, texture and mesh, so each state is set once per group
+Quad batches - textured quads sharing one texture atlas (the UI panel), drawn with a single call
+"""
+
+# Import of necessary libraries
+import ctypes
+import math
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.error import GLError, NullFunctionError
+
+# Interleaved vertex layout: x, y, z, u, v (the unit sphere position doubles as its normal)
+vertex_stride = 5 * 4                   # Size of one vertex in bytes
+tex_coord_offset = 3 * 4                # Byte offset of the u, v pair inside a vertex
+
+# Storage of already built meshes, keyed by (slices, stacks)
+sphere_mesh_cache = {}
+
+# Tessellation levels from coarsest to finest, and the projected radius in pixels each level starts at
+sphere_lod_levels = ((8, 4), (16, 8), (24, 12), (48, 24), (96, 48))
+sphere_lod_min_pixels = (0, 8, 24, 80, 200)
+sphere_lod_hysteresis = 0.2             # Fraction the size has to move past a threshold before the level changes
+
+# --- Methods ---
+# Builds packed vertex and index arrays of a unit sphere, same layout as the old immediate mode strips
+def build_sphere_arrays(slices, stacks):
+    # Latitudes go from the south pole to the north pole, longitudes wrap around once (seam is duplicated for UVs)
+    lat = math.pi * (-0.5 + np.arange(stacks + 1) / stacks)
+    lng = 2.0 * math.pi * np.arange(slices + 1) / slices
+    lat_grid, lng_grid = np.meshgrid(lat, lng, indexing="ij")
+    vertices = np.empty((stacks + 1, slices + 1, 5), dtype=np.float32)
+    vertices[..., 0] = np.cos(lng_grid) * np.cos(lat_grid)
+    vertices[..., 1] = np.sin(lng_grid) * np.cos(lat_grid)
+    vertices[..., 2] = np.sin(lat_grid)
+    vertices[..., 3] = np.arange(slices + 1)[np.newaxis, :] / slices
+    vertices[..., 4] = np.arange(stacks + 1)[:, np.newaxis] / stacks
+    # Two triangles per quad, wound the same way as the triangle strips they replace
+    grid = np.arange((stacks + 1) * (slices + 1), dtype=np.uint32).reshape(stacks + 1, slices + 1)
+    a0, a1 = grid[:-1, :-1], grid[:-1, 1:]
+    b0, b1 = grid[1:, :-1], grid[1:, 1:]
+    indices = np.stack((a0, b0, a1, a1, b0, b1), axis=-1)
+    return vertices.reshape(-1, 5), indices.reshape(-1)
+
+# Returns the shared mesh for the given tessellation, building it on first use
+def get_sphere_mesh(slices, stacks):
+    key = (slices, stacks)
+    if key not in sphere_mesh_cache:
+        sphere_mesh_cache[key] = SphereMesh(slices, stacks)
+    return sphere_mesh_cache[key]
+
+# Picks the tessellation level for a body of the given projected radius, starting from its current level
+# Going finer needs the size to pass the threshold by the hysteresis margin, going coarser needs it to fall the same margin below
+def select_lod_level(current_level, projected_pixels):
+    level = current_level
+    while level + 1 < len(sphere_lod_levels) and projected_pixels >= sphere_lod_min_pixels[level + 1] * (1 + sphere_lod_hysteresis):
+        level += 1
+    while level > 0 and projected_pixels < sphere_lod_min_pixels[level] * (1 - sphere_lod_hysteresis):
+        level -= 1
+    return level
+
+# Level that matches the given tessellation, or the closest one by vertex count
+def nearest_lod_level(slices, stacks):
+    return min(range(len(sphere_lod_levels)), key=lambda level: abs(sphere_lod_levels[level][0] * sphere_lod_levels[level][1] - slices * stacks))
+
+# Releases every cached mesh (used when the GL context goes away)
+def clear_sphere_mesh_cache():
+    for mesh in sphere_mesh_cache.values():
+        mesh.release()
+    sphere_mesh_cache.clear()
+
+# Packed vertices of one closed circle per radius around the origin, each circle is segments + 1 vertices long
+def build_circle_arrays(radii, segments=128):
+    angle = 2.0 * math.pi * np.arange(segments + 1) / segments
+    radii = np.asarray(radii, dtype=np.float32)[:, np.newaxis]
+    vertices = np.zeros((len(radii), segments + 1, 3), dtype=np.float32)
+    vertices[..., 0] = radii * np.cos(angle)
+    vertices[..., 1] = radii * np.sin(angle)
+    return vertices.reshape(-1, 3)
+
+# --- Classes ---
+# Unit sphere uploaded once into vertex buffers, falls back to client side vertex arrays
+class SphereMesh:
+    def __init__(self, slices, stacks):
+        self.slices, self.stacks = slices, stacks
+        self.vertices, self.indices = build_sphere_arrays(slices, stacks)
+        self.index_count = len(self.indices)
+        self.vertex_buffer, self.index_buffer = None, None
+        try:
+            self.vertex_buffer, self.index_buffer = glGenBuffers(2)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+            glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, GL_STATIC_DRAW)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indices.nbytes, self.indices, GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        except (GLError, NullFunctionError):
+            # Buffer objects are not available - the arrays stay in client memory
+            self.vertex_buffer, self.index_buffer = None, None
+
+    def uses_buffers(self):
+        return self.vertex_buffer is not None
+
+    def bind(self):
+        # Points the enabled vertex, normal and texture coordinate arrays at this mesh (the render queue enables them)
+        if self.uses_buffers():
+            glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.index_buffer)
+            glVertexPointer(3, GL_FLOAT, vertex_stride, ctypes.c_void_p(0))
+            glNormalPointer(GL_FLOAT, vertex_stride, ctypes.c_void_p(0))
+            glTexCoordPointer(2, GL_FLOAT, vertex_stride, ctypes.c_void_p(tex_coord_offset))
+        else:
+            # Pointers go straight into the packed numpy storage, which the mesh keeps alive
+            vertex_address = self.vertices.ctypes.data
+            glVertexPointer(3, GL_FLOAT, vertex_stride, ctypes.c_void_p(vertex_address))
+            glNormalPointer(GL_FLOAT, vertex_stride, ctypes.c_void_p(vertex_address))
+            glTexCoordPointer(2, GL_FLOAT, vertex_stride, ctypes.c_void_p(vertex_address + tex_coord_offset))
+
+    def draw_bound(self):
+        # Draws the mesh after bind(), any number of times with different transforms
+        indices = ctypes.c_void_p(0) if self.uses_buffers() else ctypes.c_void_p(self.indices.ctypes.data)
+        glDrawElements(GL_TRIANGLES, self.index_count, GL_UNSIGNED_INT, indices)
+
+    def release(self):
+        if self.uses_buffers():
+            glDeleteBuffers(2, [self.vertex_buffer, self.index_buffer])
+            self.vertex_buffer, self.index_buffer = None, None
+
+# Point cloud drawn in one call, positions are streamed into a dynamic vertex buffer every frame
+class ParticleBatch:
+    def __init__(self, capacity, colour=(0.6, 0.55, 0.5), point_size=1.5):
+        self.capacity = capacity
+        self.colour = colour
+        self.point_size = point_size
+        self.vertex_buffer = None
+        try:
+            self.vertex_buffer = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+            glBufferData(GL_ARRAY_BUFFER, capacity * 3 * 4, None, GL_DYNAMIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+        except (GLError, NullFunctionError):
+            self.vertex_buffer = None # Points are drawn straight from client memory
+
+    def draw(self, positions):
+        # positions is a contiguous float32 (n, 3) array
+        count = min(len(positions), self.capacity)
+        if not count:
+            return
+        glDisable(GL_LIGHTING)
+        glDisable(GL_TEXTURE_2D)
+        glColor3f(*self.colour)
+        glPointSize(self.point_size)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        if self.vertex_buffer is not None:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, count * 3 * 4, positions)
+            glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
+            glDrawArrays(GL_POINTS, 0, count)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+        else:
+            glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(positions.ctypes.data))
+            glDrawArrays(GL_POINTS, 0, count)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glColor3f(1, 1, 1)
+        glEnable(GL_LIGHTING)
+
+    def release(self):
+        if self.vertex_buffer is not None:
+            glDeleteBuffers(1, [self.vertex_buffer])
+            self.vertex_buffer = None
+
+# Line strips sharing one vertex buffer, every strip is a (first vertex, vertex count) range drawn in a single call
+class LineBatch:
+    def __init__(self, vertices, colour=(0.3, 0.3, 0.35), dynamic=False, version=None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        self.colour = colour
+        self.version = version                  # Version of the source the buffer was last filled from
+        self.vertex_buffer = None
+        try:
+            self.vertex_buffer = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+            glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, GL_DYNAMIC_DRAW if dynamic else GL_STATIC_DRAW)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+        except (GLError, NullFunctionError):
+            self.vertex_buffer = None # Strips are drawn straight from client memory
+
+    def update_rows(self, rows, runs, version):
+        # rows is the (row count, row length, 3) source, only the given (first, count) vertex runs of every row
+        # are copied and uploaded - e.g. the slots of the newest trail samples
+        if version == self.version:
+            return
+        self.version = version
+        row_count, row_length = rows.shape[:2]
+        target = self.vertices.reshape(row_count, row_length, 3)
+        for first, count in runs:
+            target[:, first:first + count] = rows[:, first:first + count]
+        if self.vertex_buffer is None or not runs:
+            return
+        glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+        for row in range(row_count):
+            for first, count in runs:
+                glBufferSubData(GL_ARRAY_BUFFER, (row * row_length + first) * 12, count * 12, target[row, first:first + count])
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self, firsts, counts):
+        # firsts and counts are int32 arrays - strips shorter than two vertices are left out, as some drivers
+        # skip the whole call when one of the ranges is empty
+        drawn = counts > 1
+        if not drawn.all():
+            firsts, counts = np.ascontiguousarray(firsts[drawn]), np.ascontiguousarray(counts[drawn])
+        if not len(counts):
+            return
+        glDisable(GL_LIGHTING)
+        glDisable(GL_TEXTURE_2D)
+        glColor3f(*self.colour)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        if self.vertex_buffer is not None:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vertex_buffer)
+            glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
+        else:
+            glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(self.vertices.ctypes.data))
+        glMultiDrawArrays(GL_LINE_STRIP, firsts, counts, len(counts))
+        if self.vertex_buffer is not None:
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glColor3f(1, 1, 1)
+        glEnable(GL_LIGHTING)
+
+    def release(self):
+        if self.vertex_buffer is not None:
+            glDeleteBuffers(1, [self.vertex_buffer])
+            self.vertex_buffer = None
+
+# Meshes of one frame collected first and drawn sorted by state - lighting, then texture, then mesh -
+# so lighting is switched, a texture bound and a mesh's arrays set up once per group instead of once per body
+class RenderQueue:
+    def __init__(self):
+        self.items = []
+        self.submitted = 0                      # Items drawn by the last flush
+        self.state_changes = 0                  # Lighting, texture and mesh switches made by the last flush
+
+    def submit(self, mesh, texture_id, lit, position, angle, scale):
+        # texture_id None draws untextured (e.g. while the texture is still being decoded), angle is in degrees
+        self.items.append((lit, texture_id or 0, id(mesh), mesh, position, angle, scale))
+
+    def flush(self):
+        # Issues every queued draw, leaves lighting on and texturing off like the other batches
+        self.items.sort(key=lambda item: item[:3])
+        lit, texture_id, mesh = None, None, None
+        state_changes = 0
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        for item_lit, item_texture_id, _, item_mesh, (x, y, z), angle, scale in self.items:
+            if item_lit != lit:
+                if item_lit:
+                    glEnable(GL_LIGHTING)
+                else:
+                    glDisable(GL_LIGHTING)
+                lit = item_lit
+                state_changes += 1
+            if item_texture_id != texture_id:
+                if not item_texture_id:
+                    glDisable(GL_TEXTURE_2D)
+                else:
+                    if not texture_id:
+                        glEnable(GL_TEXTURE_2D)
+                    glBindTexture(GL_TEXTURE_2D, item_texture_id)
+                texture_id = item_texture_id
+                state_changes += 1
+            if item_mesh is not mesh:
+                item_mesh.bind()
+                mesh = item_mesh
+                state_changes += 1
+            glPushMatrix()
+            glTranslatef(x, y, z)
+            glRotatef(angle, 0, 0, 1)
+            glScalef(scale, scale, scale)
+            mesh.draw_bound()
+            glPopMatrix()
+        if mesh is not None and mesh.uses_buffers():
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisable(GL_TEXTURE_2D)
+        glEnable(GL_LIGHTING)
+        self.submitted = len(self.items)
+        self.state_changes = state_changes
+        self.items.clear()
+
+# Textured quads sharing one texture atlas, corners are fixed offsets from an origin given when drawing.
+# Changing the picture of a quad only rewrites its four texture coordinates
+class QuadBatch:
+    def __init__(self, count):
+        self.count = count
+        self.offsets = np.zeros((count * 4, 3), dtype=np.float32)
+        self.vertices = np.zeros((count * 4, 3), dtype=np.float32)
+        self.tex_coords = np.zeros((count * 4, 2), dtype=np.float32)
+
+    def set_quad(self, index, x, y, width, height):
+        # Corners counter-clockwise from the bottom left, facing the camera
+        self.offsets[index * 4:index * 4 + 4] = ((x, y, 0), (x + width, y, 0), (x + width, y + height, 0), (x, y + height, 0))
+
+    def set_tex_coords(self, index, left, bottom, right, top):
+        self.tex_coords[index * 4:index * 4 + 4] = ((left, bottom), (right, bottom), (right, top), (left, top))
+
+    def draw(self, texture_id, origin):
+        np.add(self.offsets, np.asarray(origin, dtype=np.float32), out=self.vertices)
+        glDisable(GL_LIGHTING)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(self.vertices.ctypes.data))
+        glTexCoordPointer(2, GL_FLOAT, 0, ctypes.c_void_p(self.tex_coords.ctypes.data))
+        glDrawArrays(GL_QUADS, 0, self.count * 4)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisable(GL_TEXTURE_2D)
+        glEnable(GL_LIGHTING)
@@ -0,0 +1,104 @@
+"""
+Space Simulator CW2 - Scene files
+Author:
+Lukas Kubinec
+Loads the celestial bodies of a scene from a JSON (or TOML) file instead of hardcoding them.
+Every body gives its texture, radius, orbit distance and orbit speed, and may list child bodies that orbit it.
+Texture paths are relative to the scene file.
+"""
+
+# Import of necessary libraries
+import json
+import os
+
+default_scene_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenes", "solar_system.json")
+required_body_fields = ("name", "texture", "radius", "distance", "speed")
+
+# --- Methods ---
+# Reads and validates a scene file, returns a dictionary with every optional value filled in
+def load_scene(path=default_scene_path):
+    if path.endswith(".toml"):
+        import tomllib # Python 3.11+
+        with open(path, "rb") as scene_file:
+            data = tomllib.load(scene_file)
+    else:
+        with open(path) as scene_file:
+            data = json.load(scene_file)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    scene = {
+        "name": data.get("name", os.path.basename(path)),
+        "texture_budget_mb": float(data.get("texture_budget_mb", 256)),
+        "year_body": data.get("year_body"),     # Body whose orbit is one year, None picks Earth or the first moving body
+        "slices": int(data.get("slices", 24)),
+        "stacks": int(data.get("stacks", 12)),
+        "bodies": [read_body(entry, base_dir, 0) for entry in data.get("bodies", [])],
+        "belts": [read_belt(entry) for entry in data.get("belts", [])],
+    }
+    if not scene["bodies"]:
+        raise ValueError(f"Scene {path} has no bodies")
+    names = [body["name"] for body in iter_bodies(scene["bodies"])]
+    for belt in scene["belts"]:
+        for name in belt["between"]:
+            if name not in names:
+                raise ValueError(f"Belt {belt['name']!r} refers to unknown body {name!r}")
+    if scene["year_body"] is not None and scene["year_body"] not in names:
+        raise ValueError(f"Year body {scene['year_body']!r} is not in the scene")
+    return scene
+
+# Checks one body entry and its children
+def read_body(entry, base_dir, depth):
+    missing = [field for field in required_body_fields if field not in entry]
+    if missing:
+        raise ValueError(f"Body {entry.get('name', '?')!r} is missing {', '.join(missing)}")
+    texture = os.path.normpath(os.path.join(base_dir, entry["texture"]))
+    if not os.path.isfile(texture):
+        raise ValueError(f"Texture of body {entry['name']!r} not found: {texture}") # Decoded later, so checked up front
+    return {
+        "name": str(entry["name"]),
+        "texture": texture,
+        "radius": float(entry["radius"]),
+        "distance": float(entry["distance"]),
+        "speed": float(entry["speed"]),
+        "spin": float(entry.get("spin", 2 if depth else 1)),   # Moons spin twice as fast by default
+        "phase": float(entry.get("phase", 0.0)),                # Orbit angle at time 0 in degrees
+        "children": [read_body(child, base_dir, depth + 1) for child in entry.get("children", [])],
+    }
+
+# Checks one particle belt entry
+def read_belt(entry):
+    between = entry.get("between", [])
+    if len(between) != 2:
+        raise ValueError(f"Belt {entry.get('name', '?')!r} needs two bodies in 'between'")
+    return {
+        "name": str(entry.get("name", "Belt")),
+        "count": int(entry.get("count", 10000)),
+        "between": [str(name) for name in between],
+        "margin": float(entry.get("margin", 0.0)),
+    }
+
+# Every body of the tree, parents before their children
+def iter_bodies(bodies):
+    for body in bodies:
+        yield body
+        yield from iter_bodies(body["children"])
+
+# Body with the given name
+def find_body(bodies, name):
+    for body in iter_bodies(bodies):
+        if body["name"] == name:
+            return body
+    raise KeyError(name)
+
+# Simulated time of one orbit of the body that defines a year - the given one, the scene's year_body,
+# Earth, or else the first body with an orbit speed
+def year_length(scene, name=None):
+    bodies = list(iter_bodies(scene["bodies"]))
+    names = [body["name"] for body in bodies]
+    name = name or scene["year_body"] or ("Earth" if "Earth" in names else None)
+    if name is None:
+        speeds = [abs(body["speed"]) for body in bodies if body["speed"]]
+        return 360.0 / speeds[0] if speeds else 360.0
+    speed = abs(find_body(scene["bodies"], name)["speed"])
+    if not speed:
+        raise ValueError(f"Body {name!r} does not orbit, it cannot define a year")
+    return 360.0 / speed
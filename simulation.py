@@ -0,0 +1,390 @@
+"""
+Space Simulator CW2 - Simulation state
+Author:
+Lukas Kubinec
+Orbital state of every celestial body, stored as one array per attribute and evaluated in a single batched update.
+The simulation clock advances it in fixed steps from real elapsed time, optionally on its own thread,
+and blends the last two steps for drawing.
+"""
+
+# Import of necessary libraries
+import threading
+import time
+import numpy as np
+from nbody import GravitySimulation
+from snapshot import capture as capture_snapshot, restore as restore_snapshot
+
+# --- Methods ---
+# Orbital state of every body of a scene, parents before children, with the body names in the same order
+def state_from_scene(scene):
+    state = OrbitalState()
+    names = []
+    def add_bodies(bodies, parent):
+        for body in bodies:
+            index = state.add_body(body["distance"], body["speed"], body["spin"], parent, np.radians(body["phase"]))
+            names.append(body["name"])
+            add_bodies(body["children"], index)
+    add_bodies(scene["bodies"], -1)
+    return state, names
+
+# --- Classes ---
+# Struct-of-arrays storage of all bodies, index of a body is returned by add_body
+# Positions are a closed-form function of the simulated time, so any time can be reached in O(1)
+class OrbitalState:
+    # Per body arrays, grown together when the capacity runs out
+    array_names = ("pos", "offset", "distance", "orbit_speed", "phase", "orbit_angle", "spin_speed", "spin_angle", "parent", "depth")
+
+    def __init__(self, capacity=16):
+        self.count = 0                                              # Number of bodies in use
+        self.time = 0.0                                             # Simulated time the state was evaluated at
+        self.pos = np.zeros((capacity, 2))                          # World X/Y position
+        self.offset = np.zeros((capacity, 2))                       # X/Y position relative to the parent
+        self.distance = np.zeros(capacity)                          # Orbit radius around the parent
+        self.orbit_speed = np.zeros(capacity)                       # Orbit speed in degrees per unit of simulated time
+        self.phase = np.zeros(capacity)                             # Orbit angle at time 0 in radians
+        self.orbit_angle = np.zeros(capacity)                       # Current orbit angle in radians
+        self.spin_speed = np.zeros(capacity)                        # Rotation speed around own axis
+        self.spin_angle = np.zeros(capacity)                        # Rotation around own axis
+        self.parent = np.full(capacity, -1, dtype=np.intp)          # Index of the parent body, -1 orbits the origin
+        self.depth = np.zeros(capacity, dtype=np.intp)              # Number of parents above the body
+        self._levels = None                                         # Body indices grouped by depth, rebuilt on demand
+        self._moving_levels = None                                  # Same for the bodies that move, None marks the tree dirty
+        self._moving = None                                         # All moving bodies in one array
+
+    def _grow(self):
+        # Doubles the capacity of every array, keeping the stored bodies
+        capacity = len(self.distance) * 2
+        for name in self.array_names:
+            old = getattr(self, name)
+            new = np.full((capacity,) + old.shape[1:], -1 if name == "parent" else 0, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add_body(self, distance, orbit_speed, spin_speed, parent=-1, phase=0.0):
+        if self.count == len(self.distance):
+            self._grow()
+        index = self.count
+        self.count += 1
+        self.distance[index] = distance
+        self.orbit_speed[index] = orbit_speed
+        self.phase[index] = phase           # 0 starts the body on the positive X axis of its parent
+        self.spin_speed[index] = spin_speed
+        self.parent[index] = parent
+        self.depth[index] = 0 if parent < 0 else self.depth[parent] + 1
+        self.invalidate()
+        self.evaluate(np.array([index]))
+        self.pos[index] = self.offset[index] if parent < 0 else self.offset[index] + self.pos[parent]
+        return index
+
+    def invalidate(self):
+        # Called whenever bodies or their orbits change, the next update evaluates the whole tree again
+        self._levels = None
+        self._moving_levels = None
+
+    def levels(self):
+        # Parents always come before their children, so positions can be resolved one depth at a time
+        if self._levels is None:
+            depth = self.depth[:self.count]
+            self._levels = [np.flatnonzero(depth == level) for level in range(int(depth.max(initial=-1)) + 1)]
+        return self._levels
+
+    def evaluate(self, indices=slice(None)):
+        # Orbit and spin angles straight from the time - reducing the degrees first keeps precision over long runs
+        if isinstance(indices, slice):
+            indices = slice(0, self.count)
+        travelled = np.radians(np.fmod(self.orbit_speed[indices] * self.time, 360.0))
+        self.orbit_angle[indices] = np.fmod(self.phase[indices] + travelled, 2 * np.pi)
+        self.offset[indices, 0] = self.distance[indices] * np.cos(self.orbit_angle[indices])
+        self.offset[indices, 1] = self.distance[indices] * np.sin(self.orbit_angle[indices])
+        self.spin_angle[indices] = self.spin_speed[indices] * self.time
+
+    def angles_at(self, time, orbit_angle, spin_angle):
+        # Orbit and spin angles of every body at any time written into the given arrays, the state itself is left alone
+        count = self.count
+        travelled = np.radians(np.fmod(self.orbit_speed[:count] * time, 360.0))
+        np.fmod(self.phase[:count] + travelled, 2 * np.pi, out=orbit_angle)
+        np.multiply(self.spin_speed[:count], time, out=spin_angle)
+
+    def moving_levels(self):
+        # Bodies with an orbit speed and everything they carry along, grouped by depth like levels()
+        if self._moving_levels is None:
+            moving = self.orbit_speed[:self.count] != 0
+            for indices in self.levels()[1:]:
+                moving[indices] |= moving[self.parent[indices]]
+            self._moving_levels = [indices[moving[indices]] for indices in self.levels()]
+            self._moving = np.flatnonzero(moving)
+        return self._moving_levels
+
+    def update_positions(self, levels=None):
+        # World positions composed from the offsets, one batch per depth with parents resolved first
+        for indices in self.levels() if levels is None else levels:
+            parents = self.parent[indices]
+            self.pos[indices] = self.offset[indices]
+            children = parents >= 0
+            self.pos[indices[children]] += self.pos[parents[children]]
+
+    def seek(self, time):
+        # Jumps straight to the given simulated time
+        self.time = float(time)
+        if self._moving_levels is None:
+            self.evaluate()
+            self.update_positions()
+            self.moving_levels()
+            return
+        # Bodies that never move keep their cached positions, only the spins of all bodies follow the time
+        self.evaluate(self._moving)
+        self.spin_angle[:self.count] = self.spin_speed[:self.count] * self.time
+        self.update_positions(self._moving_levels)
+
+    def step(self, delta_time):
+        if delta_time or self._moving_levels is None:
+            self.seek(self.time + delta_time) # Paused steps leave the positions as they are
+
+# Headless simulation - orbital state plus the pause handling that used to live in the main loop
+class Simulation:
+    def __init__(self, delta_time=60.0 / 1000.0):
+        self.state = OrbitalState()
+        self.step_delta_time = delta_time           # Simulated time advanced per step while running
+        self.delta_time = delta_time                # Simulated time advanced by the next step (0 while paused)
+        self.time_paused = False
+        self.steps = 0                              # Number of steps taken
+        self.gravity = None                         # N-body physics mode, None follows the kinematic orbits
+        self.particle_fields = []                   # Asteroid belts and other small bodies, moved after every step
+        self.particles_follow_steps = True          # False when the particles are moved to the drawn time instead
+        self.trails = []                            # Position histories appended to after every step
+
+    def add_body(self, distance, orbit_speed, spin_speed, parent=-1, phase=0.0):
+        return self.state.add_body(distance, orbit_speed, spin_speed, parent, phase)
+
+    def add_particle_field(self, field):
+        self.particle_fields.append(field)
+        field.update(self.state.time)
+        return field
+
+    def add_trail(self, trail):
+        self.trails.append(trail)
+        trail.append(self.state.pos[:self.state.count], self.state.time)
+        return trail
+
+    def update_particles(self, time=None):
+        for field in self.particle_fields:
+            field.update(self.state.time if time is None else time)
+
+    def set_paused(self, paused):
+        self.time_paused = paused
+        self.delta_time = 0 if paused else self.step_delta_time
+
+    def toggle_pause(self):
+        self.set_paused(not self.time_paused)
+
+    @property
+    def time(self):
+        return self.state.time
+
+    def set_gravity(self, enabled, method="barnes_hut"):
+        # Physics mode starts from the current kinematic positions, switching it off returns to the orbits
+        if enabled:
+            self.gravity = GravitySimulation.from_orbital_state(self.state, method=method)
+        else:
+            self.gravity = None
+            self.state.seek(self.state.time)
+
+    def toggle_gravity(self):
+        self.set_gravity(self.gravity is None)
+
+    def seek(self, time):
+        self.state.seek(time)
+        for trail in self.trails:
+            trail.clear() # History does not connect across the jump
+            trail.append(self.state.pos[:self.state.count], self.state.time)
+        if self.particles_follow_steps:
+            self.update_particles()
+        if self.gravity is not None:
+            self.set_gravity(True, self.gravity.method) # Integration restarts from the orbits at the new time
+
+    def step(self):
+        if self.gravity is None:
+            self.state.step(self.delta_time)
+        else:
+            if self.delta_time:
+                self.gravity.step(self.delta_time)
+            # Spins keep following the time, positions come from the integrator
+            self.state.time += self.delta_time
+            self.state.evaluate()
+            self.state.pos[:self.state.count] = self.gravity.pos[:, :2]
+            self.state.invalidate() # Static bodies moved too, the next seek evaluates every body again
+        if self.delta_time:
+            for trail in self.trails:
+                trail.append(self.state.pos[:self.state.count], self.state.time)
+            if self.particles_follow_steps:
+                self.update_particles()
+        self.steps += 1
+
+# Fixed-step driver - real elapsed time times the time scale is consumed in steps of equal size,
+# so the simulation keeps its speed however fast frames are drawn. Pause and time scale are handled only here.
+class SimulationClock:
+    def __init__(self, simulation, steps_per_second=60.0, time_scale=1.0, max_steps_per_advance=2000, max_elapsed=0.25):
+        self.simulation = simulation
+        self.step_interval = 1.0 / steps_per_second         # Real seconds per step at time scale 1
+        self.time_scale = time_scale
+        self.max_steps_per_advance = max_steps_per_advance  # Time beyond this is dropped instead of stalling the frame
+        self.max_elapsed = max_elapsed                      # Longer gaps (loading, dragging the window) are not caught up
+        self.accumulator = 0.0                              # Scaled real time not yet consumed by a step
+        self.lock = threading.Lock()                        # Held while the state changes, needed with the worker thread
+        self.thread = None
+        self.running = False
+        self.keyframe_log = None                            # Records keyframes while set, see snapshot.KeyframeLog
+        self.replay = None                                  # Restores recorded keyframes while set, see snapshot.Replay
+        self._last_advance = time.perf_counter()
+        simulation.particles_follow_steps = False           # Particles are moved to the drawn time by interpolate()
+        self._resize()
+        self.render_time = simulation.time
+        simulation.update_particles(self.render_time)
+        simulation.state.angles_at(self.render_time, self.render_orbit_angle, self.render_spin_angle)
+
+    def _resize(self):
+        # Positions before and after the last step, plus the blended positions that are drawn
+        count = self.simulation.state.count
+        self.previous_pos = self.simulation.state.pos[:count].copy()
+        self.previous_time = self.simulation.time
+        self.render_pos = self.previous_pos.copy()
+        self.render_orbit_angle = np.zeros(count)           # Angles at the drawn time, see interpolate()
+        self.render_spin_angle = np.zeros(count)
+
+    def _settle(self):
+        # After a jump the previous step is forgotten, so nothing is blended across it
+        self._resize()
+        self.accumulator = 0.0
+
+    @property
+    def paused(self):
+        return self.simulation.time_paused
+
+    def toggle_pause(self):
+        with self.lock:
+            self.simulation.toggle_pause()
+            self.accumulator = 0.0
+
+    def set_time_scale(self, time_scale):
+        with self.lock:
+            self.time_scale = time_scale
+
+    def seek(self, time):
+        with self.lock:
+            self.simulation.seek(time)
+            self._settle()
+            self._record_keyframe()
+
+    def toggle_gravity(self):
+        with self.lock:
+            self.simulation.toggle_gravity()
+            self._settle()
+            self._record_keyframe()
+
+    def capture(self, view=None):
+        # Snapshot record of the current state, taken between two steps
+        with self.lock:
+            return capture_snapshot(self.simulation, view)
+
+    def restore(self, record):
+        # Puts a snapshot record back, returns the view stored with it
+        with self.lock:
+            view = restore_snapshot(self.simulation, record)
+            self._settle()
+            self._record_keyframe()
+        return view
+
+    def _record_keyframe(self):
+        # Jumps always get a keyframe, so a replay can never step across them
+        if self.keyframe_log is not None and self.replay is None:
+            self.keyframe_log.record(self.simulation)
+
+    def start_replay(self, replay):
+        with self.lock:
+            self.replay = replay
+            replay.apply(self.simulation)
+            self._settle()
+
+    def stop_replay(self):
+        with self.lock:
+            if self.replay is not None:
+                self.replay.stop(self.simulation)
+                self.replay = None
+                self._record_keyframe() # Recording carries on from wherever the replay stopped
+
+    def _step(self):
+        state = self.simulation.state
+        if len(self.previous_pos) != state.count:
+            self._resize()
+        if self.replay is not None:
+            self.replay.apply(self.simulation)
+        np.copyto(self.previous_pos, state.pos[:state.count])
+        self.previous_time = state.time
+        self.simulation.step()
+        if self.keyframe_log is not None and self.replay is None:
+            self.keyframe_log.maybe_record(self.simulation)
+
+    def _advance(self, elapsed):
+        # Takes as many whole steps as the elapsed time covers, the remainder waits for the next call
+        self._last_advance = time.perf_counter()
+        if self.paused:
+            return 0
+        self.accumulator += min(elapsed, self.max_elapsed) * self.time_scale
+        steps = min(int(self.accumulator / self.step_interval), self.max_steps_per_advance)
+        for _ in range(steps):
+            self._step()
+        self.accumulator -= steps * self.step_interval
+        self.accumulator = min(self.accumulator, self.step_interval) # Drops what could not be caught up
+        return steps
+
+    def advance(self, elapsed):
+        # Called once per frame with the real seconds since the last frame (when no worker thread runs)
+        with self.lock:
+            return self._advance(elapsed)
+
+    def interpolate(self):
+        # Blends the last two steps by the fraction of the next step already elapsed, returns the blend factor
+        with self.lock:
+            pending = self.accumulator
+            if self.thread is not None and not self.paused:
+                pending += (time.perf_counter() - self._last_advance) * self.time_scale
+            alpha = min(pending / self.step_interval, 1.0) if not self.paused else 1.0
+            state = self.simulation.state
+            if len(self.previous_pos) != state.count:
+                self._resize()
+            np.subtract(state.pos[:state.count], self.previous_pos, out=self.render_pos)
+            self.render_pos *= alpha
+            self.render_pos += self.previous_pos
+            render_time = self.previous_time + (state.time - self.previous_time) * alpha
+            if render_time != self.render_time:
+                self.simulation.update_particles(render_time)
+            self.render_time = render_time
+            # Angles follow the time directly, so the drawn spin is as smooth as the blended positions
+            state.angles_at(render_time, self.render_orbit_angle, self.render_spin_angle)
+        return alpha
+
+    def start_thread(self):
+        # Steps on a worker thread at its own rate, the drawing thread only calls interpolate()
+        if self.thread is not None:
+            return
+        self.running = True
+        self._last_advance = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, name="simulation", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        last = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            with self.lock:
+                self._advance(now - last)
+                wait = (self.step_interval - self.accumulator) / max(self.time_scale, 1e-9) # Until the next step is due
+            last = now
+            time.sleep(min(max(wait, 0.0005), 0.05))
+
+    def stop_thread(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.thread.join()
+        self.thread = None
@@ -0,0 +1,216 @@
+"""
+Space Simulator CW2 - Snapshots and replay
+Author:
+Lukas Kubinec
+Binary snapshots of the whole simulation (bodies, N-body physics, camera and selected object).
+A file is a small versioned header followed by fixed-size records, so it is written in one bulk write
+and memory-mapped when read - resuming from a snapshot takes milliseconds instead of re-simulating.
+Keyframe logs use the same layout with one record appended per keyframe, replays restore them in order.
+"""
+
+# Import of necessary libraries
+import os
+import struct
+import numpy as np
+from nbody import GravitySimulation
+
+# File layout: magic, format version, reserved, number of bodies per record, followed by the records
+snapshot_magic = b"SSIM"
+snapshot_version = 1
+file_header = struct.Struct("<4sHHI")
+gravity_methods = ("", "barnes_hut", "direct")      # Stored as an index, "" is the kinematic orbits
+
+# One body of a record - the orbital state arrays plus the N-body position, velocity and mass
+body_dtype = np.dtype([
+    ("pos", "<f8", (2,)), ("offset", "<f8", (2,)), ("distance", "<f8"), ("orbit_speed", "<f8"), ("phase", "<f8"),
+    ("orbit_angle", "<f8"), ("spin_speed", "<f8"), ("spin_angle", "<f8"), ("parent", "<i8"), ("depth", "<i8"),
+    ("gravity_pos", "<f8", (3,)), ("gravity_vel", "<f8", (3,)), ("mass", "<f8"),
+])
+state_fields = ("pos", "offset", "distance", "orbit_speed", "phase", "orbit_angle", "spin_speed", "spin_angle", "parent", "depth")
+scene_fields = ("distance", "orbit_speed", "phase", "spin_speed", "parent")     # Set by the scene, never by the simulation
+
+# --- Methods ---
+# Record layout for a given number of bodies, packed so it maps straight onto the file
+def record_dtype(body_count):
+    return np.dtype([
+        ("time", "<f8"), ("steps", "<i8"), ("delta_time", "<f8"), ("gravity", "<i4"),
+        ("active_object", "<i4"), ("camera", "<f8", (3,)), ("time_scale", "<f8"), ("paused", "u1"),
+        ("bodies", body_dtype, (body_count,)),
+    ])
+
+# Copies the simulation (and optionally the view) into a new record
+def capture(simulation, view=None):
+    state = simulation.state
+    count = state.count
+    record = np.zeros((), dtype=record_dtype(count))
+    record["time"] = state.time
+    record["steps"] = simulation.steps
+    record["delta_time"] = simulation.step_delta_time
+    record["paused"] = simulation.time_paused
+    bodies = record["bodies"]
+    for name in state_fields:
+        bodies[name] = getattr(state, name)[:count]
+    if simulation.gravity is not None:
+        record["gravity"] = gravity_methods.index(simulation.gravity.method)
+        bodies["gravity_pos"] = simulation.gravity.pos
+        bodies["gravity_vel"] = simulation.gravity.vel
+        bodies["mass"] = simulation.gravity.mass
+    if view is not None:
+        record["camera"] = view["camera"]
+        record["active_object"] = view["active_object"]
+        record["time_scale"] = view["time_scale"]
+    return record
+
+# Raises ValueError unless the record was taken from the same scene - same bodies, orbits and tree
+def check_scene(state, record):
+    bodies = record["bodies"]
+    if len(bodies) != state.count:
+        raise ValueError(f"Snapshot has {len(bodies)} bodies, the simulation has {state.count}")
+    changed = [name for name in scene_fields if not np.array_equal(bodies[name], getattr(state, name)[:state.count])]
+    if changed:
+        raise ValueError("Recorded from a different scene, it differs in " + ", ".join(changed))
+
+# Puts a record back into a simulation built from the same scene, returns the stored view
+def restore(simulation, record):
+    state = simulation.state
+    bodies = record["bodies"]
+    check_scene(state, record)
+    for name in state_fields:
+        getattr(state, name)[:state.count] = bodies[name]
+    state.time = float(record["time"])
+    state.invalidate()
+    simulation.steps = int(record["steps"])
+    method = gravity_methods[int(record["gravity"])]
+    if method:
+        # Forces are recomputed from the stored positions, so stepping continues exactly as before
+        simulation.gravity = GravitySimulation(bodies["gravity_pos"], bodies["gravity_vel"], bodies["mass"], method=method)
+    else:
+        simulation.gravity = None
+    for trail in simulation.trails:
+        trail.clear()
+        trail.append(state.pos[:state.count], state.time)
+    if simulation.particles_follow_steps:
+        simulation.update_particles()
+    return {
+        "camera": tuple(float(value) for value in record["camera"]),
+        "active_object": int(record["active_object"]),
+        "time_scale": float(record["time_scale"]),
+        "paused": bool(record["paused"]),
+    }
+
+# Writes a single record, replacing atomically so a crash never leaves half a snapshot behind
+def write_snapshot(path, record):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    header = file_header.pack(snapshot_magic, snapshot_version, 0, len(record["bodies"]))
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(header + record.tobytes())
+    os.replace(temp_path, path)
+
+# Memory-maps every record of a snapshot or keyframe log
+def read_records(path):
+    with open(path, "rb") as snapshot_file:
+        header = snapshot_file.read(file_header.size)
+    if len(header) != file_header.size:
+        raise ValueError(path + " is not a simulation snapshot")
+    magic, version, _, body_count = file_header.unpack(header)
+    if magic != snapshot_magic:
+        raise ValueError(path + " is not a simulation snapshot")
+    if version != snapshot_version:
+        raise ValueError(f"{path} has snapshot version {version}, only version {snapshot_version} is supported")
+    dtype = record_dtype(body_count)
+    count = (os.path.getsize(path) - file_header.size) // dtype.itemsize # A torn last record is ignored
+    if not count:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=file_header.size, shape=(count,))
+
+# Newest record of a snapshot file
+def read_snapshot(path):
+    records = read_records(path)
+    if not len(records):
+        raise ValueError(path + " holds no snapshot")
+    return records[-1]
+
+# --- Classes ---
+# Append-only log of keyframes - one record per keyframe, written as a single write and flushed.
+# Later runs append to the same log, a replay plays all of them in order
+class KeyframeLog:
+    def __init__(self, path, interval_steps=600, view_state=None):
+        self.path = path
+        self.interval_steps = interval_steps    # Steps between two periodic keyframes
+        self.view_state = view_state            # Returns the view dictionary stored with each keyframe
+        self.last_steps = None
+        self.file = None
+
+    def record(self, simulation):
+        if self.file is None:
+            self.open(simulation)
+        self.file.write(capture(simulation, self.view_state() if self.view_state else None).tobytes())
+        self.file.flush()
+        self.last_steps = simulation.steps
+
+    def maybe_record(self, simulation):
+        if self.last_steps is None or simulation.steps - self.last_steps >= self.interval_steps:
+            self.record(simulation)
+
+    def open(self, simulation):
+        # Keyframes are appended to an existing log of the same scene, raises ValueError for any other file
+        if self.file is not None:
+            return
+        state = simulation.state
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            self.file = open(self.path, "wb")
+            self.file.write(file_header.pack(snapshot_magic, snapshot_version, 0, state.count))
+            return
+        records = read_records(self.path)
+        if records.dtype != record_dtype(state.count):
+            raise ValueError(f"{self.path} holds keyframes of {records.dtype['bodies'].shape[0]} bodies, the simulation has {state.count}")
+        if len(records):
+            check_scene(state, records[-1])
+        end = file_header.size + len(records) * records.dtype.itemsize
+        del records
+        # A torn last record (e.g. after a crash) is cut off, so new records stay aligned
+        self.file = open(self.path, "r+b")
+        self.file.truncate(end)
+        self.file.seek(end)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# Replays a keyframe log - the simulation steps as usual and every keyframe is restored once its step is reached
+class Replay:
+    def __init__(self, records):
+        self.records = records
+        self.next = 0                   # Index of the next keyframe to restore
+        self.view = None                # View of the last restored keyframe, taken by the caller
+        self.original_delta_time = None
+
+    @property
+    def finished(self):
+        return self.next >= len(self.records)
+
+    def apply(self, simulation):
+        # Called before every step, restores all keyframes up to the current step
+        if self.original_delta_time is None:
+            self.original_delta_time = simulation.step_delta_time
+            simulation.steps = int(self.records[0]["steps"]) if len(self.records) else simulation.steps
+        while not self.finished and self._due(simulation.steps):
+            record = self.records[self.next]
+            self.view = restore(simulation, record)
+            # Steps are as long as when the log was recorded, so stepping matches the recording
+            simulation.step_delta_time = float(record["delta_time"])
+            if not simulation.time_paused:
+                simulation.delta_time = simulation.step_delta_time
+            self.next += 1
+
+    def _due(self, steps):
+        # A keyframe with fewer steps than the one before it starts a new stretch of the log (e.g. after a replay)
+        steps_due = self.records[self.next]["steps"]
+        return steps_due <= steps or (self.next > 0 and steps_due < self.records[self.next - 1]["steps"])
+
+    def stop(self, simulation):
+        if self.original_delta_time is not None:
+            simulation.step_delta_time = self.original_delta_time
+            if not simulation.time_paused:
+                simulation.delta_time = simulation.step_delta_time
@@ -0,0 +1,172 @@
+"""
+Space Simulator CW2 - Texture loading
+Author:
+Lukas Kubinec
+Decodes texture images on a thread pool and keeps the raw RGBA pixels in an on-disk cache.
+Cache files are memory-mapped on the next start, so warm starts skip image decoding entirely.
+Texture residency uploads textures the first time they are needed and evicts the least recently seen ones under a memory budget.
+"""
+
+# Import of necessary libraries
+import collections
+import hashlib
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pygame
+
+# Cache file layout: magic, width, height, followed by the raw RGBA rows
+cache_magic = b"RGBA"
+cache_header = struct.Struct("<4sII")
+default_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".texture_cache")
+
+# --- Methods ---
+# Name of the cache file - changes whenever the source file is replaced or modified
+def cache_key(path):
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest() + ".rgba"
+
+# Decodes an image file into RGBA bytes, same layout as used by apply_texture before
+def decode_image(path):
+    image = pygame.image.load(path)
+    return DecodedTexture(image.get_width(), image.get_height(), pygame.image.tobytes(image, "RGBA", False))
+
+# Maps a cache file into memory, returns None if it is missing or damaged
+def read_cache_file(cache_path):
+    try:
+        with open(cache_path, "rb") as cache_file:
+            magic, width, height = cache_header.unpack(cache_file.read(cache_header.size))
+        if magic != cache_magic or os.path.getsize(cache_path) != cache_header.size + width * height * 4:
+            return None
+        data = np.memmap(cache_path, dtype=np.uint8, mode="r", offset=cache_header.size, shape=(height, width, 4))
+        return DecodedTexture(width, height, data)
+    except (OSError, struct.error, ValueError):
+        return None
+
+# Writes the decoded pixels next to the other cache files, replacing atomically so readers never see half a file
+def write_cache_file(cache_path, texture):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as cache_file:
+        cache_file.write(cache_header.pack(cache_magic, texture.width, texture.height))
+        cache_file.write(texture.data)
+    os.replace(temp_path, cache_path)
+
+# --- Classes ---
+# Raw RGBA pixels - offers get_width/get_height so it can be passed to apply_texture like a pygame surface
+class DecodedTexture:
+    def __init__(self, width, height, data):
+        self.width = width
+        self.height = height
+        self.data = data        # bytes after decoding, read-only memory map when coming from the cache
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+# Loads textures in the background, every file is decoded at most once per run
+class TextureLoader:
+    def __init__(self, cache_dir=default_cache_dir, max_workers=None):
+        self.cache_dir = cache_dir              # None disables the on-disk cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1), thread_name_prefix="texture")
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def _load(self, path):
+        if self.cache_dir is None:
+            return decode_image(path)
+        cache_path = os.path.join(self.cache_dir, cache_key(path))
+        texture = read_cache_file(cache_path)
+        if texture is None:
+            texture = decode_image(path)
+            try:
+                write_cache_file(cache_path, texture)
+            except OSError:
+                pass # A read-only cache only costs the warm start
+        return texture
+
+    def request(self, path):
+        # Starts loading the file unless it is already loading, returns its future
+        with self.lock:
+            if path not in self.futures:
+                self.futures[path] = self.executor.submit(self._load, path)
+            return self.futures[path]
+
+    def forget(self, path):
+        # Drops the decoded pixels of a file, the next request loads it again (from the cache when enabled)
+        with self.lock:
+            self.futures.pop(path, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# GPU textures uploaded on first use and evicted least-recently-seen first once over the budget
+# upload(texture) returns a texture id, release(texture_id) frees it - both run on the thread that owns the GL context
+class TextureResidency:
+    def __init__(self, loader, upload, release, budget_bytes):
+        self.loader = loader
+        self.upload = upload
+        self.release = release
+        self.budget_bytes = budget_bytes
+        self.resident = collections.OrderedDict()       # path -> [texture id, size in bytes, last frame used], oldest first
+        self.resident_bytes = 0
+        self.frame = 0
+        self.uploads = 0
+        self.evictions = 0
+        self.failed = set()                             # Paths that could not be decoded, drawn untextured from then on
+
+    def begin_frame(self):
+        self.frame += 1
+
+    def acquire(self, path):
+        # Texture id for drawing, or None while the image is still being decoded in the background (or failed to decode)
+        entry = self.resident.get(path)
+        if entry is not None:
+            entry[2] = self.frame
+            self.resident.move_to_end(path)
+            return entry[0]
+        if path in self.failed:
+            return None
+        future = self.loader.request(path)
+        if not future.done():
+            return None
+        try:
+            texture = future.result()
+        except (OSError, ValueError, pygame.error) as error:
+            # A damaged file must not stop the drawing, the body stays untextured
+            print(f"Texture {path} could not be loaded: {error}")
+            self.failed.add(path)
+            self.loader.forget(path)
+            return None
+        texture_id = self.upload(texture)
+        self.loader.forget(path) # Pixels now live on the GPU
+        size = texture.width * texture.height * 4
+        self.resident[path] = [texture_id, size, self.frame]
+        self.resident_bytes += size
+        self.uploads += 1
+        self.evict()
+        return texture_id
+
+    def evict(self):
+        # Textures used in the current frame are never evicted, so the budget can be exceeded while they are all on screen
+        for path in list(self.resident):
+            if self.resident_bytes <= self.budget_bytes:
+                break
+            texture_id, size, last_frame = self.resident[path]
+            if last_frame == self.frame:
+                continue
+            del self.resident[path]
+            self.release(texture_id)
+            self.resident_bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        for texture_id, _, _ in self.resident.values():
+            self.release(texture_id)
+        self.resident.clear()
+        self.resident_bytes = 0
@@ -0,0 +1,71 @@
+"""
+Space Simulator CW2 - Orbit trails
+Author:
+Lukas Kubinec
+Recent positions of every body kept in a fixed-capacity ring buffer, appended to by the simulation step.
+Memory stays at the ring capacity however long the simulation runs, and a sample costs O(1) per body.
+"""
+
+# Import of necessary libraries
+import numpy as np
+
+# --- Classes ---
+# Position history of all bodies. Every sample is written twice, at its slot and at slot + capacity,
+# so the newest samples of a body are always one contiguous run of vertices that can be drawn as a line strip
+class TrailBuffer:
+    def __init__(self, body_count, capacity=512, sample_interval=0.0):
+        self.body_count = body_count
+        self.capacity = capacity
+        self.sample_interval = sample_interval          # Simulated time between samples, 0 samples every step
+        self.vertices = np.zeros((body_count, 2 * capacity, 3), dtype=np.float32)
+        self.lengths = np.full(body_count, capacity)    # Longest trail drawn for each body, in samples
+        self.head = 0                                   # Slot the next sample goes to
+        self.filled = 0                                 # Samples stored so far, up to the capacity
+        self.samples = 0                                # Samples appended since creation, never reset - copies refresh from it
+        self._next_sample_time = None
+
+    def set_length(self, index, samples):
+        self.lengths[index] = int(np.clip(samples, 0, self.capacity))
+
+    def append(self, pos, time):
+        # pos is the (n, 2) array of body positions in the orbital plane
+        if self._next_sample_time is not None and time < self._next_sample_time:
+            return False
+        self._next_sample_time = time + self.sample_interval
+        count = min(len(pos), self.body_count)
+        self.vertices[:count, self.head, :2] = pos[:count]
+        self.vertices[:count, self.head + self.capacity, :2] = pos[:count]
+        self.head = (self.head + 1) % self.capacity
+        self.filled = min(self.filled + 1, self.capacity)
+        self.samples += 1
+        return True
+
+    def clear(self):
+        # Forgets the history, used when the simulation jumps in time
+        self.head = 0
+        self.filled = 0
+        self._next_sample_time = None
+
+    def ranges(self):
+        # First vertex and vertex count of every body's trail inside the flattened vertex array
+        counts = np.minimum(self.lengths, self.filled).astype(np.int32)
+        last = self.head - 1 + self.capacity # Copy of the newest sample that has all older ones right before it
+        firsts = (np.arange(self.body_count) * 2 * self.capacity + last + 1 - counts).astype(np.int32)
+        return firsts, counts
+
+    def written_runs(self, since_samples):
+        # Vertex runs (first, count) inside a body's row holding the samples appended after since_samples,
+        # the same runs for every body. Both copies of each slot are covered, a run may wrap past the end of the ring
+        count = min(self.samples - since_samples, self.capacity)
+        if count <= 0:
+            return []
+        if count == self.capacity:
+            return [(0, 2 * self.capacity)]
+        first = (self.head - count) % self.capacity
+        runs = [(first, count), (first + self.capacity, min(count, self.capacity - first))]
+        if first + count > self.capacity:
+            runs.append((0, first + count - self.capacity))
+        return runs
+
+    def nbytes(self):
+        return self.vertices.nbytes + self.lengths.nbytes